@@ -0,0 +1,129 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import time
+
+from . import metrics
+
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+# Set by tasks doing work nobody is waiting for, inherited by the tasks
+# they start.
+priority = contextvars.ContextVar("priority", default=INTERACTIVE)
+
+
+def run_in_background():
+    priority.set(BACKGROUND)
+
+
+class Urgency:
+    # Priority of a call made on behalf of several callers, like a fetch
+    # shared through a cache. It goes up to that of the most urgent
+    # caller, even while the call is already waiting for a slot.
+    def __init__(self, name):
+        self.name = name
+        self.queued = None
+
+    def raise_to(self, name):
+        if PRIORITIES.index(name) >= PRIORITIES.index(self.name):
+            return
+        (old, self.name) = (self.name, name)
+        if self.queued is not None:
+            (admission, user_id, waiter) = self.queued
+            if not waiter.done():
+                admission.move(waiter, user_id, old, name)
+
+
+# Set by tasks running shared calls.
+urgency = contextvars.ContextVar("urgency", default=None)
+
+
+def get_priority():
+    shared = urgency.get()
+    return priority.get() if shared is None else shared.name
+
+
+class Admission:
+    # Limits the number of calls in flight to an instance. Calls over
+    # the limit wait in a queue per user and are let in round robin, so
+    # that one user's big batch doesn't hold up everyone else's
+    # commands. Interactive calls go before background work.
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.queues = {name: collections.OrderedDict()
+                       for name in PRIORITIES}
+
+    def count_waiting(self):
+        return sum(len(waiters) for queues in self.queues.values()
+                   for waiters in queues.values())
+
+    @contextlib.asynccontextmanager
+    async def slot(self, user_id):
+        if self.active < self.limit and not self.count_waiting():
+            self.active += 1
+        else:
+            await self.wait(user_id, urgency.get())
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def wait(self, user_id, shared):
+        name = priority.get() if shared is None else shared.name
+        waiter = asyncio.get_running_loop().create_future()
+        queue = self.queues[name].setdefault(user_id, collections.deque())
+        queue.append(waiter)
+        if shared is not None:
+            shared.queued = (self, user_id, waiter)
+        started = time.perf_counter()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if shared is not None:
+                name = shared.name
+            if waiter.done() and not waiter.cancelled():
+                # Got the slot just as it was cancelled, pass it on.
+                self.release()
+            else:
+                self.discard(name, user_id, waiter)
+            raise
+        finally:
+            if shared is not None:
+                shared.queued = None
+        if shared is not None:
+            name = shared.name
+        metrics.api_queue_wait.observe(time.perf_counter() - started, name)
+
+    def move(self, waiter, user_id, old, new):
+        # To another priority, behind the user's other calls there.
+        self.discard(old, user_id, waiter)
+        self.queues[new].setdefault(user_id, collections.deque()) \
+            .append(waiter)
+
+    def discard(self, name, user_id, waiter):
+        queue = self.queues[name].get(user_id)
+        if queue is not None:
+            with contextlib.suppress(ValueError):
+                queue.remove(waiter)
+            if not queue:
+                del self.queues[name][user_id]
+
+    def release(self):
+        # The slot goes straight to the next waiter, if any.
+        for queues in self.queues.values():
+            while queues:
+                (user_id, queue) = next(iter(queues.items()))
+                waiter = queue.popleft()
+                if queue:
+                    queues.move_to_end(user_id)
+                else:
+                    del queues[user_id]
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        self.active -= 1
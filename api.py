@@ -1,8 +1,17 @@
+import asyncio
+import collections
+import random
+import time
 import urllib.parse
 from enum import IntEnum
 
 import aiohttp
 
+from . import codec, metrics
+from .admission import Admission
+from .breaker import CircuitBreaker
+from .utils import gather_limited
+
 
 class MediaStatus(IntEnum):
     UNKNOWN = 1
@@ -12,6 +21,14 @@ class MediaStatus(IntEnum):
     AVAILABLE = 5
 
 
+class RequestStatus(IntEnum):
+    PENDING = 1
+    APPROVED = 2
+    DECLINED = 3
+    FAILED = 4
+    COMPLETED = 5
+
+
 class OverseerrError(Exception):
     def __init__(self, status, reason, message, errors):
         super().__init__(message or reason)
@@ -25,11 +42,19 @@ class OverseerrError(Exception):
             f"{self.message!r}, {self.errors!r})"
 
 
+class OverseerrUnavailable(OverseerrError):
+    # The server can't be reached or keeps failing, raised without
+    # calling it while the circuit breaker is open.
+    def __init__(self, message):
+        super().__init__(HTTP_SERVICE_UNAVAILABLE, "Service Unavailable",
+                         message, [])
+
+
 async def raise_for_status(resp):
     if resp.status < 400:
         return
     try:
-        error = await resp.json()
+        error = await resp.json(loads=codec.loads)
     except ValueError:
         error = {}
     raise OverseerrError(resp.status, resp.reason,
@@ -37,12 +62,98 @@ async def raise_for_status(resp):
                          error.get("errors", []))
 
 
+DEFAULT_POOL_SIZE = 100
+DEFAULT_KEEPALIVE_TIMEOUT = 30
+DEFAULT_CONCURRENCY = 8
+DEFAULT_SESSION_MAX_IDLE = 3600
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_RETRIES = 2
+DEFAULT_RETRY_BACKOFF = 0.5
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_PROBE_INTERVAL = 15
+DEFAULT_MAX_ACTIVE_CALLS = 16
+HTTP_UNAUTHORIZED = 401
+HTTP_SERVER_ERROR = 500
+HTTP_SERVICE_UNAVAILABLE = 503
+# Failures worth trying again, and counted by the circuit breaker.
+TRANSIENT_ERRORS = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+
+class APISettings:
+    # How the skill talks to Overseerr: connection pool, limits, paging,
+    # timeouts, retries and the circuit breaker. The same for all
+    # instances.
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE,
+                 keepalive_timeout=DEFAULT_KEEPALIVE_TIMEOUT,
+                 concurrency=DEFAULT_CONCURRENCY,
+                 max_active_calls=DEFAULT_MAX_ACTIVE_CALLS,
+                 session_max_idle=DEFAULT_SESSION_MAX_IDLE,
+                 page_size=DEFAULT_PAGE_SIZE, project=True,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT,
+                 retries=DEFAULT_RETRIES,
+                 retry_backoff=DEFAULT_RETRY_BACKOFF,
+                 breaker_threshold=DEFAULT_BREAKER_THRESHOLD,
+                 breaker_probe_interval=DEFAULT_BREAKER_PROBE_INTERVAL):
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.concurrency = concurrency
+        self.max_active_calls = max_active_calls
+        self.session_max_idle = session_max_idle
+        self.page_size = page_size
+        # Keep only the fields of responses that are actually used.
+        self.project = project
+        # No total timeout, large listings may take a while as long as
+        # the data keeps coming.
+        self.timeout = aiohttp.ClientTimeout(total=None,
+                                             sock_connect=connect_timeout,
+                                             sock_read=read_timeout)
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.breaker_threshold = breaker_threshold
+        self.breaker_probe_interval = breaker_probe_interval
+
+    @classmethod
+    def from_config(cls, config):
+        # From the skill's validated config.
+        return cls(pool_size=config["pool-size"],
+                   keepalive_timeout=config["keepalive-timeout"],
+                   concurrency=config["concurrency"],
+                   max_active_calls=config["max-active-calls"],
+                   session_max_idle=config["session-max-idle"],
+                   page_size=config["page-size"],
+                   project=config["project-responses"],
+                   connect_timeout=config["connect-timeout"],
+                   read_timeout=config["read-timeout"],
+                   retries=config["retries"],
+                   retry_backoff=config["retry-backoff"],
+                   breaker_threshold=config["breaker-threshold"],
+                   breaker_probe_interval=config["breaker-probe-interval"])
+
+
 class OverseerrAPI:
-    def __init__(self, url, api_key=None):
+    def __init__(self, url, api_key=None, settings=None, metadata_cache=None,
+                 services=None, search_cache=None, store=None):
+        if settings is None:
+            settings = APISettings()
         self.parsed_url = urllib.parse.urlparse(url)
+        self.api_key = api_key
         self.headers = {}
         if api_key:
             self.headers["X-Api-Key"] = api_key
+        self.settings = settings
+        self.metadata_cache = metadata_cache
+        self.services = services
+        self.search_cache = search_cache
+        self.store = store
+        self.breaker = CircuitBreaker(settings.breaker_threshold,
+                                      settings.breaker_probe_interval,
+                                      self.probe)
+        self.admission = Admission(settings.max_active_calls)
+        self.sessions = {}
+        self.connector = None
 
     def make_abs_url(self, path, query=None, qs=""):
         if query:
@@ -53,38 +164,182 @@ class OverseerrAPI:
     def make_url(self, path, query=None, qs=""):
         return self.make_abs_url("/api/v1" + path, query, qs)
 
-    def new_session(self):
-        return OverseerrSession(self)
+    def get_connector(self):
+        # Created lazily because the connector must be bound to the
+        # running event loop.
+        if self.connector is None or self.connector.closed:
+            self.connector = aiohttp.TCPConnector(
+                limit=self.settings.pool_size,
+                keepalive_timeout=self.settings.keepalive_timeout)
+        return self.connector
+
+    def new_session(self, authenticator=None, user_id=None):
+        return OverseerrSession(self, authenticator, user_id)
+
+    def get_session(self, user_id, authenticator=None):
+        # Sessions are kept per user so the login cookie can be reused
+        # by the following commands.
+        try:
+            session = self.sessions[user_id]
+        except KeyError:
+            session = self.new_session(authenticator, user_id)
+            self.sessions[user_id] = session
+        session.touch()
+        return session
+
+    def forget_session(self, user_id):
+        session = self.sessions.pop(user_id, None)
+        if session:
+            session.close()
+
+    def forget_idle_sessions(self):
+        for user_id, session in list(self.sessions.items()):
+            if session.get_idle_time() > self.settings.session_max_idle:
+                self.forget_session(user_id)
+
+    async def probe(self):
+        # Used by the circuit breaker, /status doesn't need a login.
+        session = self.new_session()
+        try:
+            await session.transmit("GET", "/status")
+        finally:
+            session.close()
+
+    async def close(self):
+        self.breaker.close()
+        for user_id in list(self.sessions):
+            self.forget_session(user_id)
+        if self.connector is not None:
+            await self.connector.close()
+            self.connector = None
 
 
 class OverseerrSession:
-    def __init__(self, api):
+    def __init__(self, api, authenticator=None, user_id=None):
         self.api = api
-        self.session = aiohttp.ClientSession(headers=api.headers)
+        # Whose turn it is when calls have to wait, see Admission.
+        self.user_id = user_id
+        # Coroutine function returning the Plex token to log in with.
+        self.authenticator = authenticator
+        self.authenticated = False
+        self.atime = time.monotonic()
+        # All sessions share the connection pool of the API, the session
+        # itself only carries the cookie jar with the user's login.
+        self.session = aiohttp.ClientSession(
+            connector=api.get_connector(),
+            connector_owner=False,
+            cookie_jar=aiohttp.CookieJar(),
+            headers=api.headers,
+            json_serialize=codec.dumps)
+
+    def close(self):
+        # The connector belongs to the API, so there is nothing to wait
+        # for, just let go of it.
+        self.session.detach()
+
+    def touch(self):
+        self.atime = time.monotonic()
+
+    def get_idle_time(self):
+        return time.monotonic() - self.atime
 
     async def get(self, path, query=None, qs=""):
-        url = self.api.make_url(path, query, qs)
-        async with self.session.get(url) as resp:
-            await raise_for_status(resp)
-            return await resp.json()
+        return await self.call("GET", path, query, qs)
 
     async def post(self, path, data=None, query=None, qs=""):
-        url = self.api.make_url(path, query, qs)
-        async with self.session.post(url, json=data) as resp:
-            await raise_for_status(resp)
-            return await resp.json()
+        return await self.call("POST", path, query, qs, data)
 
     async def delete(self, path, query=None, qs=""):
+        return await self.call("DELETE", path, query, qs)
+
+    async def call(self, method, path, query=None, qs="", data=None):
+        try:
+            return await self.send(method, path, query, qs, data)
+        except OverseerrError as error:
+            if error.status != HTTP_UNAUTHORIZED:
+                raise
+            # The login has expired, log in again and retry once.
+            self.authenticated = False
+            if not await self.login():
+                raise
+        return await self.send(method, path, query, qs, data)
+
+    async def send(self, method, path, query=None, qs="", data=None):
+        breaker = self.api.breaker
+        if breaker.is_open():
+            raise OverseerrUnavailable("Overseerr is not responding")
+
+        # Only GETs are safe to repeat.
+        retries = self.api.settings.retries if method == "GET" else 0
+        for attempt in range(retries + 1):
+            try:
+                async with self.api.admission.slot(self.user_id):
+                    result = await self.transmit(method, path, query, qs,
+                                                 data)
+            except OverseerrError as error:
+                if error.status < HTTP_SERVER_ERROR:
+                    breaker.success()
+                    raise
+                failure = error
+            except TRANSIENT_ERRORS as error:
+                failure = error
+            else:
+                breaker.success()
+                return result
+            if attempt < retries:
+                # Exponential backoff with full jitter, so that users
+                # don't all come back at the same moment.
+                delay = self.api.settings.retry_backoff * 2 ** attempt
+                await asyncio.sleep(random.uniform(0, delay))
+
+        breaker.failure()
+        if isinstance(failure, OverseerrError):
+            raise failure
+        raise OverseerrUnavailable("Overseerr is not responding") \
+            from failure
+
+    async def transmit(self, method, path, query=None, qs="", data=None):
         url = self.api.make_url(path, query, qs)
-        async with self.session.delete(url) as resp:
-            await raise_for_status(resp)
-            return await resp.read()
+        template = metrics.path_template(path)
+        try:
+            with metrics.api_latency.time(method, template):
+                async with self.session.request(
+                        method, url, json=data,
+                        timeout=self.api.settings.timeout) as resp:
+                    metrics.api_responses.inc(method, template, resp.status)
+                    await raise_for_status(resp)
+                    if method == "DELETE":
+                        return await resp.read()
+                    return await resp.json(loads=codec.loads)
+        except OverseerrError as error:
+            metrics.api_errors.inc(error.status)
+            raise
+
+    def trim(self, value, fields):
+        if not self.api.settings.project:
+            return value
+        return codec.project(value, fields)
 
     ### Login
 
+    async def login(self):
+        if self.authenticator is None:
+            return False
+        auth_token = await self.authenticator()
+        if not auth_token:
+            return False
+        try:
+            await self.login_plex(auth_token)
+        except OverseerrError:
+            return False
+        return True
+
     async def login_plex(self, auth_token):
         data = {"authToken": auth_token}
-        return await self.post("/auth/plex", data)
+        # Not using post() which would try to log in again on failure.
+        user = await self.send("POST", "/auth/plex", data=data)
+        self.authenticated = True
+        return user
 
     async def login_local(self, username, password):
         data = {"username": username,
@@ -97,8 +352,21 @@ class OverseerrSession:
     ### Search
 
     async def search(self, term, page=None, language=None):
+        term = " ".join(term.split())
         query = dict(query=term, page=page, language=language)
-        return await self.get("/search", query)
+        cache = self.api.search_cache
+        if cache is None:
+            return await self.fetch_search(query)
+        # Searches are shared by all users of the instance.
+        key = (term.casefold(), page, language)
+        return await cache.get_or_fetch(key,
+                                        lambda: self.fetch_search(query))
+
+    async def fetch_search(self, query):
+        response = await self.get("/search", query)
+        response["results"] = self.trim(response["results"],
+                                        codec.MEDIA_FIELDS)
+        return response
 
     ### Requests
 
@@ -106,16 +374,32 @@ class OverseerrSession:
                             order=None, requested_by=None):
         query = dict(take=take, skip=skip, filter=kind,
                      sort=order, requestedBy=requested_by)
-        return await self.get("/request", query)
+        response = await self.get("/request", query)
+        response["results"] = self.trim(response["results"],
+                                        codec.REQUEST_FIELDS)
+        return response
+
+    def iter_requests(self, page_size=None, kind=None, order=None,
+                      requested_by=None):
+        return RequestStream(self, page_size or self.api.settings.page_size,
+                             kind=kind, order=order,
+                             requested_by=requested_by)
 
     async def get_request(self, request_id):
-        return await self.get(f"/request/{request_id}")
+        request = await self.get(f"/request/{request_id}")
+        return self.trim(request, codec.REQUEST_FIELDS)
 
     async def update_request_status(self, request_id, status):
-        return await self.post(f"/request/{request_id}/{status}")
+        result = await self.post(f"/request/{request_id}/{status}")
+        if self.api.store is not None:
+            self.api.store.refresh_soon(request_id)
+        return result
 
     async def delete_request(self, request_id):
-        return await self.delete(f"/request/{request_id}")
+        result = await self.delete(f"/request/{request_id}")
+        if self.api.store is not None:
+            self.api.store.remove(request_id)
+        return result
 
     async def request(self, media_type, media_id,
                       server_id=None, profile_id=None,
@@ -129,17 +413,34 @@ class OverseerrSession:
             data["profileId"] = profile_id
         if root_folder is not None:
             data["rootFolder"] = root_folder
-        return await self.post("/request", data)
+        result = await self.post("/request", data)
+        if self.api.store is not None:
+            self.api.store.refresh_soon(result["id"])
+        return result
 
     ### Media
 
     async def get_movie(self, movie_id, language=None):
-        query = dict(language=language)
-        return await self.get(f"/movie/{movie_id}", query)
-        
+        return await self.get_media("movie", movie_id, language)
+
     async def get_tv(self, tv_id, language=None):
+        return await self.get_media("tv", tv_id, language)
+
+    async def get_media(self, media_type, media_id, language=None):
+        path = f"/{media_type}/{media_id}"
         query = dict(language=language)
-        return await self.get(f"/tv/{tv_id}", query)
+        cache = self.api.metadata_cache
+        if cache is None:
+            return await self.fetch_media(path, query)
+        # Titles and dates hardly ever change so the lookups are shared
+        # by all users and rooms.
+        key = (self.api.parsed_url.geturl(), media_type, media_id, language)
+        return await cache.get_or_fetch(key,
+                                        lambda: self.fetch_media(path, query))
+
+    async def fetch_media(self, path, query):
+        media = await self.get(path, query)
+        return self.trim(media, codec.MEDIA_FIELDS)
 
     async def get_info(self, media):
         if media["mediaType"] == "movie":
@@ -148,6 +449,16 @@ class OverseerrSession:
             return await self.get_tv(media["tmdbId"])
         return {}
 
+    async def get_infos(self, medias):
+        # Look up every distinct media once, a few at a time, and return
+        # the results in the same order as the input.
+        keys = [(media["mediaType"], media["tmdbId"]) for media in medias]
+        unique = dict(zip(keys, medias))
+        infos = await gather_limited(self.api.settings.concurrency,
+                                     map(self.get_info, unique.values()))
+        found = dict(zip(unique, infos))
+        return [found[key] for key in keys]
+
     ### Service
 
     async def get_radarr(self):
@@ -161,3 +472,71 @@ class OverseerrSession:
 
     async def get_sonarr_server(self, server_id):
         return await self.get(f"/service/sonarr/{server_id}")
+
+
+class RequestStream:
+    # Async iterator over all requests matching the filters. The next
+    # page is fetched in the background while the current one is being
+    # consumed.
+    def __init__(self, session, page_size, **filters):
+        self.session = session
+        self.page_size = page_size
+        self.filters = filters
+        self.total = None
+        self.skip = 0
+        self.page = collections.deque()
+        self.next_page = None
+        self.exhausted = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.page:
+            await self.load()
+            if not self.page:
+                raise StopAsyncIteration
+        return self.page.popleft()
+
+    async def take(self, count):
+        results = []
+        async for result in self:
+            results.append(result)
+            if len(results) >= count:
+                break
+        return results
+
+    async def load(self):
+        if self.exhausted:
+            return
+        if self.next_page is None:
+            self.next_page = self.fetch()
+        try:
+            response = await self.next_page
+        finally:
+            self.next_page = None
+
+        results = response["results"]
+        self.total = response["pageInfo"]["results"]
+        self.skip += len(results)
+        self.page.extend(results)
+        if not results or self.skip >= self.total:
+            self.exhausted = True
+        else:
+            self.next_page = self.fetch()
+
+    def fetch(self):
+        coro = self.session.list_requests(take=self.page_size,
+                                          skip=self.skip, **self.filters)
+        return asyncio.ensure_future(coro)
+
+    def close(self):
+        if self.next_page is not None:
+            if self.next_page.done():
+                # Nobody will ask for the page, don't leave its error
+                # unretrieved.
+                if not self.next_page.cancelled():
+                    self.next_page.exception()
+            else:
+                self.next_page.cancel()
+            self.next_page = None
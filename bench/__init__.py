@@ -0,0 +1,157 @@
+import asyncio
+import importlib.util
+import json
+import os
+import re
+import sys
+import time
+
+from aiohttp import web
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = "overseerr"
+
+
+def load_skill_package():
+    # The repository root is the skill package, load it under a fixed
+    # name no matter what the checkout directory is called.
+    if PACKAGE in sys.modules:
+        return sys.modules[PACKAGE]
+    spec = importlib.util.spec_from_file_location(
+        PACKAGE, os.path.join(ROOT, "__init__.py"),
+        submodule_search_locations=[ROOT])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeMemory:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def put(self, key, value):
+        self.data[key] = value
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+
+class FakeWebServer:
+    def __init__(self):
+        self.web_app = web.Application()
+
+
+class FakeOpsdroid:
+    def __init__(self):
+        self.web_server = FakeWebServer()
+        self.memory = FakeMemory()
+        self.sent = []
+        self.on_send = None
+
+    async def send(self, event):
+        self.sent.append(event)
+        if self.on_send:
+            self.on_send(event)
+
+
+class FakeMessage:
+    # Just enough of opsdroid's Message for the skill's handlers.
+    def __init__(self, text, user_id, target, regex=None, on_respond=None):
+        self.text = text
+        self.user_id = user_id
+        self.target = target
+        self.regex = regex
+        self.responses = []
+        self.on_respond = on_respond
+
+    async def respond(self, event):
+        self.responses.append(event)
+        if self.on_respond:
+            self.on_respond(event)
+
+
+class FakeWebhookRequest:
+    def __init__(self, data, query=None):
+        self.body = json.dumps(data)
+        self.query = query or {}
+
+    async def json(self, loads=json.loads):
+        return loads(self.body)
+
+
+def match_handler(handler, text):
+    # Match the text like opsdroid does for @match_regex handlers.
+    for matcher in getattr(handler, "matchers", []):
+        regex = matcher.get("regex")
+        if regex:
+            flags = 0 if regex.get("case_sensitive", True) else re.IGNORECASE
+            return re.match(regex["expression"], text, flags)
+
+
+class User:
+    # Talks to the skill as one chat user and waits for its answers.
+    def __init__(self, skill, user_id, room):
+        self.skill = skill
+        self.user_id = user_id
+        self.room = room
+        self.waiter = None
+        self.wanted = 0
+        self.messages = []
+
+    def on_respond(self, event):
+        from opsdroid.events import Message, Image
+        if isinstance(event, (Message, Image)):
+            self.messages.append(event)
+            if self.waiter and len(self.messages) >= self.wanted \
+                    and not self.waiter.done():
+                self.waiter.set_result(None)
+
+    async def say(self, text, answers=1, timeout=30):
+        # Send a message and wait until the skill responds with the
+        # given number of messages. Returns the elapsed time.
+        self.wanted = len(self.messages) + answers
+        self.waiter = asyncio.get_running_loop().create_future()
+        started = time.perf_counter()
+        await self.dispatch(text)
+        if answers:
+            await asyncio.wait_for(self.waiter, timeout)
+        return time.perf_counter() - started
+
+    async def dispatch(self, text):
+        handlers = [self.skill.search, self.skill.requests, self.skill.abort,
+                    self.skill.help]
+        for handler in handlers:
+            regex = match_handler(handler, text)
+            if regex:
+                break
+        else:
+            handler = self.skill.catchall
+            regex = None
+        message = FakeMessage(text, self.user_id, self.room, regex,
+                              self.on_respond)
+        await handler(message)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def create_skill(url, rooms=("bench-room",), **config):
+    package = load_skill_package()
+    opsdroid = FakeOpsdroid()
+    config = dict({
+        "bot-url": "http://localhost:8080",
+        "rooms": {room: {"url": url, "notify-rooms": [room]}
+                  for room in rooms},
+    }, **config)
+    skill = package.OverseerrSkill(opsdroid, config)
+    return (skill, opsdroid)
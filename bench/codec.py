@@ -0,0 +1,168 @@
+# Measures decoding of a /request page with every JSON library that is
+# installed, and the memory kept per page with and without projecting
+# the results to the fields the skill uses.
+#
+#     python -m bench.codec --take 100 --iterations 50
+
+import argparse
+import gc
+import importlib
+import json
+import time
+import tracemalloc
+
+from . import load_skill_package, percentile
+
+
+LIBRARIES = ["json", "ujson", "orjson"]
+
+
+def make_user(user_id):
+    return {
+        "id": user_id,
+        "email": f"user{user_id}@example.com",
+        "plexUsername": f"user{user_id}",
+        "username": None,
+        "userType": 1,
+        "permissions": 32,
+        "avatar": f"https://plex.tv/users/{user_id:032x}/avatar?c=1234567890",
+        "createdAt": "2023-01-01T00:00:00.000Z",
+        "updatedAt": "2024-01-01T00:00:00.000Z",
+        "requestCount": 42,
+        "displayName": f"User {user_id}",
+        "settings": {"id": user_id, "locale": "en", "region": "US",
+                     "originalLanguage": None, "notificationTypes": {
+                         "email": 0, "discord": 0, "webpush": 4094}},
+    }
+
+
+def make_request(request_id, overview):
+    media_type = "tv" if request_id % 2 else "movie"
+    seasons = [{"id": request_id * 100 + number, "seasonNumber": number,
+                "status": 2, "createdAt": "2024-01-01T00:00:00.000Z",
+                "updatedAt": "2024-01-01T00:00:00.000Z"}
+               for number in range(1, 6 if media_type == "tv" else 1)]
+    return {
+        "id": request_id,
+        "status": 2,
+        "createdAt": "2024-01-01T00:00:00.000Z",
+        "updatedAt": "2024-01-02T00:00:00.000Z",
+        "type": media_type,
+        "is4k": False,
+        "serverId": 0,
+        "profileId": 4,
+        "rootFolder": "/media/movies",
+        "languageProfileId": None,
+        "tags": [],
+        "isAutoRequest": False,
+        "media": {
+            "downloadStatus": [{
+                "externalId": request_id, "estimatedCompletionTime":
+                "2024-01-03T00:00:00.000Z", "mediaType": media_type,
+                "size": 4000000000, "sizeLeft": 1000000000,
+                "status": "downloading", "timeLeft": "00:10:00",
+                "title": f"Release.{request_id}.1080p.WEB-DL.x264",
+            }],
+            "downloadStatus4k": [],
+            "id": request_id,
+            "mediaType": media_type,
+            "tmdbId": 1000 + request_id,
+            "tvdbId": 2000 + request_id,
+            "imdbId": f"tt{request_id:07d}",
+            "status": 3,
+            "status4k": 1,
+            "createdAt": "2024-01-01T00:00:00.000Z",
+            "updatedAt": "2024-01-02T00:00:00.000Z",
+            "lastSeasonChange": "2024-01-01T00:00:00.000Z",
+            "mediaAddedAt": None,
+            "serviceId": 0,
+            "serviceId4k": None,
+            "externalServiceId": request_id,
+            "externalServiceId4k": None,
+            "externalServiceSlug": f"title-{request_id}",
+            "externalServiceSlug4k": None,
+            "ratingKey": None,
+            "ratingKey4k": None,
+            "seasons": seasons,
+            "plexUrl": None,
+            "serviceUrl": f"http://radarr.local/movie/{request_id}",
+            "overview": overview,
+        },
+        "seasons": seasons,
+        "modifiedBy": make_user(1),
+        "requestedBy": make_user(request_id % 7 + 2),
+        "seasonCount": len(seasons),
+    }
+
+
+def make_page(take, padding):
+    overview = "x" * padding
+    return json.dumps({
+        "pageInfo": {"pages": 10, "pageSize": take,
+                     "results": take * 10, "page": 1},
+        "results": [make_request(i, overview) for i in range(1, take + 1)],
+    })
+
+
+def decode(loads, text, project):
+    page = loads(text)
+    if project is not None:
+        page["results"] = project(page["results"])
+    return page
+
+
+def measure(loads, text, iterations, project):
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        decode(loads, text, project)
+        timings.append(time.perf_counter() - started)
+
+    # Memory still held by one page once the raw data is gone.
+    gc.collect()
+    tracemalloc.start()
+    page = decode(loads, text, project)
+    gc.collect()
+    (retained, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del page
+    return (timings, retained)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--take", type=int, default=100,
+                        help="requests per page")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--padding", type=int, default=500,
+                        help="bytes of filler text per result")
+    args = parser.parse_args()
+
+    codec = load_skill_package().codec
+    projections = [
+        ("all", None),
+        ("projected", lambda results: codec.project(results,
+                                                    codec.REQUEST_FIELDS)),
+    ]
+    text = make_page(args.take, args.padding)
+    print(f"page of {args.take} requests, {len(text) / 1024:.1f} KiB, "
+          f"the skill uses {codec.NAME}")
+    print(f"{'library':<8} {'fields':<10} {'p50 ms':>9} {'p99 ms':>9} "
+          f"{'KiB kept':>9}")
+    for name in LIBRARIES:
+        try:
+            module = importlib.import_module(name)
+        except ImportError:
+            print(f"{name:<8} not installed")
+            continue
+        for label, project in projections:
+            (timings, retained) = measure(module.loads, text,
+                                          args.iterations, project)
+            p50 = percentile(timings, 0.50) * 1000
+            p99 = percentile(timings, 0.99) * 1000
+            print(f"{name:<8} {label:<10} {p50:>9.2f} {p99:>9.2f} "
+                  f"{retained / 1024:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
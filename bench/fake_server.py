@@ -0,0 +1,165 @@
+import asyncio
+import collections
+import random
+
+from aiohttp import web
+
+
+class FakeOverseerr:
+    # Stand-in for the parts of the Overseerr API used by the skill.
+    # Every response is delayed by `latency` seconds (plus up to `jitter`)
+    # and padded with `padding` bytes of overview text.
+    def __init__(self, latency=0.01, jitter=0.0, page_results=20,
+                 total_results=200, total_requests=500, padding=500):
+        self.latency = latency
+        self.jitter = jitter
+        self.page_results = page_results
+        self.total_results = total_results
+        self.padding = "x" * padding
+        self.requests = [self.make_request(i)
+                         for i in range(1, total_requests + 1)]
+        self.calls = collections.Counter()
+        self.runner = None
+        self.url = None
+
+        self.app = web.Application()
+        routes = [
+            ("POST", "/api/v1/auth/plex", self.auth),
+            ("GET", "/api/v1/status", self.status),
+            ("GET", "/api/v1/search", self.search),
+            ("GET", "/api/v1/request", self.list_requests),
+            ("POST", "/api/v1/request", self.create_request),
+            ("GET", r"/api/v1/request/{id:\d+}", self.get_request),
+            ("DELETE", r"/api/v1/request/{id:\d+}", self.delete_request),
+            ("POST", r"/api/v1/request/{id:\d+}/{status}", self.update_request),
+            ("GET", r"/api/v1/{type:movie|tv}/{id:\d+}", self.get_media),
+            ("GET", "/api/v1/service/{service}", self.list_servers),
+            ("GET", r"/api/v1/service/{service}/{id:\d+}", self.get_server),
+        ]
+        for method, path, handler in routes:
+            self.app.router.add_route(method, path, handler)
+        self.app.middlewares.append(self.middleware)
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        route = request.match_info.route.resource
+        self.calls[route.canonical if route else request.path] += 1
+        await asyncio.sleep(self.latency + random.random() * self.jitter)
+        return await handler(request)
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    ### Data
+
+    def make_request(self, request_id):
+        media_type = "movie" if request_id % 2 else "tv"
+        return {
+            "id": request_id,
+            "status": 1,
+            "createdAt": "2024-01-01T00:00:00.000Z",
+            "updatedAt": "2024-01-01T00:00:00.000Z",
+            "type": media_type,
+            "requestedBy": {"id": 1, "displayName": "bench",
+                            "email": "bench@example.com",
+                            "avatar": self.padding[:100]},
+            "media": {"id": request_id, "mediaType": media_type,
+                      "tmdbId": 1000 + request_id % 97,
+                      "status": 2 + request_id % 4,
+                      "downloadStatus": [],
+                      "seasons": [{"seasonNumber": n, "status": 2}
+                                  for n in range(3)]},
+            "seasons": [],
+        }
+
+    def make_result(self, result_id):
+        return {
+            "id": result_id,
+            "mediaType": "movie" if result_id % 3 else "tv",
+            "title": f"Title {result_id}",
+            "name": f"Show {result_id}",
+            "releaseDate": "2020-01-01",
+            "firstAirDate": "2020-01-01",
+            "voteAverage": 7.5,
+            "voteCount": 100,
+            "overview": self.padding,
+            "posterPath": f"/{result_id}.jpg",
+        }
+
+    ### Handlers
+
+    async def auth(self, request):
+        return web.json_response({"id": 1, "displayName": "bench"})
+
+    async def status(self, request):
+        return web.json_response({"version": "fake"})
+
+    async def search(self, request):
+        page = int(request.query.get("page", 1))
+        pages = -(-self.total_results // self.page_results)
+        start = (page - 1) * self.page_results
+        count = max(0, min(self.page_results, self.total_results - start))
+        return web.json_response({
+            "page": page,
+            "totalPages": pages,
+            "totalResults": self.total_results,
+            "results": [self.make_result(start + i) for i in range(count)],
+        })
+
+    async def list_requests(self, request):
+        take = int(request.query.get("take", 10))
+        skip = int(request.query.get("skip", 0))
+        return web.json_response({
+            "pageInfo": {"pages": -(-len(self.requests) // take),
+                         "pageSize": take,
+                         "results": len(self.requests),
+                         "page": skip // take + 1},
+            "results": self.requests[skip:skip + take],
+        })
+
+    async def create_request(self, request):
+        return web.json_response({"id": len(self.requests) + 1}, status=201)
+
+    async def get_request(self, request):
+        index = int(request.match_info["id"]) - 1
+        if not 0 <= index < len(self.requests):
+            raise web.HTTPNotFound()
+        return web.json_response(self.requests[index])
+
+    async def delete_request(self, request):
+        return web.Response(status=204)
+
+    async def update_request(self, request):
+        return await self.get_request(request)
+
+    async def get_media(self, request):
+        media_id = int(request.match_info["id"])
+        result = self.make_result(media_id)
+        result["mediaInfo"] = {"status": 2}
+        return web.json_response(result)
+
+    async def list_servers(self, request):
+        return web.json_response([
+            {"id": 0, "name": "main", "is4k": False, "isDefault": True},
+        ])
+
+    async def get_server(self, request):
+        return web.json_response({
+            "server": {"id": int(request.match_info["id"])},
+            "profiles": [{"id": 1, "name": "HD-1080p"},
+                         {"id": 2, "name": "Ultra-HD"}],
+            "rootFolders": [{"id": 1, "path": "/media", "freeSpace": 10**12}],
+            "tags": [],
+        })
@@ -0,0 +1,137 @@
+# Measures command latency, HTTP calls and allocations of the skill's
+# flows against a local fake Overseerr server.
+#
+#     python -m bench.flows --iterations 50 --latency 10
+
+import argparse
+import asyncio
+import collections
+import itertools
+import logging
+import time
+import tracemalloc
+
+from . import User, FakeWebhookRequest, create_skill, percentile
+from .fake_server import FakeOverseerr
+
+
+async def search_scenario(user, iteration):
+    yield ("/s", await user.say(f"/s bench {iteration}"))
+    yield ("/s more", await user.say("more"))
+    yield ("/s select", await user.say("1", answers=2))
+    await user.say("/abort")
+
+
+async def multi_search_scenario(user, iteration):
+    yield ("/s x;y;z", await user.say(f"/s one {iteration}; two; three"))
+    yield ("/s x;y more", await user.say("more"))
+    yield ("/s x;y sel", await user.say("25", answers=2))
+    await user.say("/abort")
+
+
+async def requests_scenario(user, iteration):
+    yield ("/r", await user.say("/r all 20"))
+    yield ("/r more", await user.say("more"))
+    yield ("/r select", await user.say("3", answers=2))
+    await user.say("/abort")
+
+
+async def request_scenario(user, iteration):
+    await user.say(f"/s request {iteration}")
+    await user.say("1", answers=2)
+    yield ("request", await user.say("request hd in /media"))
+
+
+async def notification_scenario(user, iteration):
+    opsdroid = user.opsdroid
+    delivered = asyncio.get_running_loop().create_future()
+    opsdroid.on_send = lambda event: delivered.done() or \
+        delivered.set_result(None)
+    data = {"notification_type": "MEDIA_AVAILABLE",
+            "subject": f"Title {iteration}"}
+    started = time.perf_counter()
+    await user.skill.notification(FakeWebhookRequest(data))
+    await asyncio.wait_for(delivered, 30)
+    yield ("webhook", time.perf_counter() - started)
+
+
+SCENARIOS = [search_scenario, multi_search_scenario, requests_scenario,
+             request_scenario, notification_scenario]
+
+
+async def run(args, trace_alloc):
+    server = FakeOverseerr(latency=args.latency / 1000,
+                           jitter=args.jitter / 1000,
+                           page_results=args.page_results,
+                           total_requests=args.requests,
+                           padding=args.padding)
+    url = await server.start()
+    (skill, opsdroid) = create_skill(url, **{"notify-window": 0})
+    await skill.startup(None)
+    user = User(skill, "bench-user", "bench-room")
+    user.opsdroid = opsdroid
+
+    latencies = collections.defaultdict(list)
+    calls = collections.defaultdict(list)
+    allocs = collections.defaultdict(list)
+    try:
+        for scenario, iteration in itertools.product(
+                SCENARIOS, range(args.iterations)):
+            before = server.total_calls()
+            if trace_alloc:
+                tracemalloc.reset_peak()
+                (start_mem, _) = tracemalloc.get_traced_memory()
+            async for (name, elapsed) in scenario(user, iteration):
+                after = server.total_calls()
+                latencies[name].append(elapsed)
+                calls[name].append(after - before)
+                if trace_alloc:
+                    (_, peak) = tracemalloc.get_traced_memory()
+                    allocs[name].append(peak - start_mem)
+                    tracemalloc.reset_peak()
+                    (start_mem, _) = tracemalloc.get_traced_memory()
+                before = server.total_calls()
+    finally:
+        await skill.on_shutdown(None)
+        await server.stop()
+    return (latencies, calls, allocs)
+
+
+def report(latencies, calls, allocs):
+    print(f"{'command':<13} {'n':>5} {'p50 ms':>9} {'p99 ms':>9} "
+          f"{'http/cmd':>9} {'peak KiB':>9}")
+    for name, values in latencies.items():
+        p50 = percentile(values, 0.50) * 1000
+        p99 = percentile(values, 0.99) * 1000
+        http = sum(calls[name]) / len(calls[name])
+        peak = (sum(allocs[name]) / len(allocs[name]) / 1024
+                if allocs.get(name) else float("nan"))
+        print(f"{name:<13} {len(values):>5} {p50:>9.2f} {p99:>9.2f} "
+              f"{http:>9.2f} {peak:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=10,
+                        help="server latency in ms")
+    parser.add_argument("--jitter", type=float, default=0,
+                        help="random extra server latency in ms")
+    parser.add_argument("--page-results", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--padding", type=int, default=500,
+                        help="bytes of filler text per result")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    # Latency is measured without tracemalloc, which slows everything
+    # down, and allocations in a second pass.
+    (latencies, calls, _) = asyncio.run(run(args, trace_alloc=False))
+    tracemalloc.start()
+    (_, _, allocs) = asyncio.run(run(args, trace_alloc=True))
+    tracemalloc.stop()
+    report(latencies, calls, allocs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# Simulates many users running interleaved commands across several rooms
+# and reports event loop lag, task counts, queue depths and memory per
+# active flow. Exits with an error if flows leave tasks behind after
+# /abort or after their context expires.
+#
+#     python -m bench.load --users 300 --rooms 10
+
+import argparse
+import asyncio
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+from . import ROOT, User, create_skill, load_skill_package, percentile
+from .fake_server import FakeOverseerr
+
+
+BENCH_DIR = os.path.join(ROOT, "bench")
+
+
+class LoopMonitor:
+    # Samples event loop lag, the number of tasks and queued messages.
+    def __init__(self, skill, interval=0.01):
+        self.skill = skill
+        self.interval = interval
+        self.lags = []
+        self.max_tasks = 0
+        self.max_queue = 0
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        self.task.cancel()
+
+    async def run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(time.perf_counter() - started - self.interval)
+            self.max_tasks = max(self.max_tasks, len(skill_tasks()))
+            self.max_queue = max(self.max_queue, queue_depth(self.skill))
+
+
+def skill_tasks():
+    # Tasks running the skill's own code, not the fake server's or ours.
+    tasks = set()
+    for task in asyncio.all_tasks():
+        code = getattr(task.get_coro(), "cr_code", None)
+        if code and code.co_filename.startswith(ROOT) and \
+                not code.co_filename.startswith(BENCH_DIR):
+            tasks.add(task)
+    return tasks
+
+
+def user_contexts(skill):
+    for room in skill.rooms.values():
+        yield from room.user_context.values()
+
+
+def queue_depth(skill):
+    return sum(context.queue.qsize() for context in user_contexts(skill)
+               if context.queue is not None)
+
+
+def active_flows(skill):
+    return sum(context.in_flow() for context in user_contexts(skill))
+
+
+async def browse(user, rng):
+    # Interleaved searches and request listings, leaving the last flow
+    # open.
+    for _ in range(2):
+        if rng.random() < 0.5:
+            await user.say(f"/s bench {rng.randrange(50)}")
+        else:
+            await user.say(f"/r all {rng.randrange(5, 20)}")
+        await asyncio.sleep(rng.random() * 0.05)
+        await user.say("more")
+        await asyncio.sleep(rng.random() * 0.05)
+        await user.say(str(rng.randrange(1, 5)), answers=2)
+
+
+async def run(args):
+    package = load_skill_package()
+    server = FakeOverseerr(latency=args.latency / 1000,
+                           jitter=args.latency / 1000)
+    url = await server.start()
+    rooms = [f"room-{n}" for n in range(args.rooms)]
+    (skill, opsdroid) = create_skill(url, rooms)
+    await skill.startup(None)
+    baseline = skill_tasks()
+    rng = random.Random(args.seed)
+    failures = []
+
+    monitor = LoopMonitor(skill)
+    monitor.start()
+    users = [User(skill, f"user-{n}", rooms[n % len(rooms)])
+             for n in range(args.users)]
+
+    # Everybody browses at the same time.
+    gc.collect()
+    (memory_before, _) = tracemalloc.get_traced_memory()
+    started = time.perf_counter()
+    await asyncio.gather(*(browse(user, rng) for user in users))
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    (memory_after, _) = tracemalloc.get_traced_memory()
+    flows = active_flows(skill)
+    tasks_open = len(skill_tasks() - baseline)
+
+    # Everybody aborts, nothing of theirs should keep running.
+    await asyncio.gather(*(user.say("/abort") for user in users))
+    await asyncio.sleep(0.1)
+    leaked = skill_tasks() - baseline
+    if leaked or active_flows(skill):
+        failures.append(f"{len(leaked)} tasks left after /abort")
+
+    # Flows left alone must go away when their context expires.
+    package.skill.CONTEXT_MAX_AGE = args.max_age
+    idle = [User(skill, f"idle-{n}", rooms[n % len(rooms)])
+            for n in range(args.users)]
+    await asyncio.gather(*(user.say(f"/s idle {n}")
+                           for n, user in enumerate(idle)))
+    await asyncio.sleep(args.max_age + 0.5)
+    leaked = skill_tasks() - baseline
+    remaining = sum(1 for context in user_contexts(skill)
+                    if context.user_id.startswith("idle-"))
+    if leaked or remaining:
+        failures.append(f"{len(leaked)} tasks and {remaining} contexts "
+                        f"left after expiry")
+
+    monitor.stop()
+    await skill.on_shutdown(None)
+    await server.stop()
+
+    lags = monitor.lags
+    print(f"users: {args.users} in {args.rooms} rooms, "
+          f"browsing took {elapsed:.2f} s")
+    print(f"HTTP calls: {server.total_calls()}")
+    print(f"loop lag ms: p50 {percentile(lags, 0.5) * 1000:.2f}, "
+          f"p99 {percentile(lags, 0.99) * 1000:.2f}, "
+          f"max {max(lags) * 1000:.2f}")
+    print(f"skill tasks: max {monitor.max_tasks}, "
+          f"with open flows {tasks_open}")
+    print(f"max queued messages: {monitor.max_queue}")
+    if flows:
+        per_flow = (memory_after - memory_before) / flows / 1024
+        print(f"active flows: {flows}, {per_flow:.1f} KiB per flow")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=10,
+                        help="server latency in ms")
+    parser.add_argument("--max-age", type=float, default=1,
+                        help="context max age in seconds for the expiry test")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    ok = asyncio.run(run(args))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# Measures what the skill costs opsdroid at startup: importing the
+# package (in a fresh interpreter each time), creating the skill with
+# many rooms, the startup event, which compiles the templates in a
+# thread, and the first command, which pays for anything still deferred.
+#
+#     python -m bench.startup --rooms 50 --instances 5
+
+import argparse
+import asyncio
+import statistics
+import subprocess
+import sys
+import time
+
+from . import ROOT, FakeOpsdroid, User, load_skill_package
+
+
+# Opsdroid has loaded these by the time it loads skills, they don't
+# count towards the skill's import time.
+IMPORT_SCRIPT = """
+import sys, time
+import aiohttp.web, opsdroid.skill, opsdroid.events, opsdroid.matchers
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+from bench import load_skill_package
+load_skill_package()
+print(time.perf_counter() - started)
+"""
+
+
+def measure_import(iterations):
+    script = IMPORT_SCRIPT.format(root=ROOT)
+    timings = []
+    for _ in range(iterations):
+        output = subprocess.run([sys.executable, "-c", script], check=True,
+                                capture_output=True, text=True).stdout
+        timings.append(float(output.split()[-1]))
+    return timings
+
+
+def make_config(rooms, instances):
+    return {
+        "bot-url": "http://localhost:8080",
+        "rooms": {f"room-{n}": {"url": f"http://overseerr-{n % instances}",
+                                "notify-rooms": [f"room-{n}"]}
+                  for n in range(rooms)},
+    }
+
+
+async def measure_init(iterations, rooms, instances):
+    package = load_skill_package()
+    timings = []
+    startups = []
+    first_command = []
+    for _ in range(iterations):
+        config = make_config(rooms, instances)
+        started = time.perf_counter()
+        skill = package.OverseerrSkill(FakeOpsdroid(), config)
+        timings.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await skill.startup(None)
+        startups.append(time.perf_counter() - started)
+
+        user = User(skill, "bench-user", "room-0")
+        first_command.append(await user.say("/help"))
+        await skill.on_shutdown(None)
+    return (timings, startups, first_command)
+
+
+def report(name, timings):
+    print(f"{name:<14} {statistics.median(timings) * 1000:>9.2f} "
+          f"{min(timings) * 1000:>9.2f} {max(timings) * 1000:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--rooms", type=int, default=50)
+    parser.add_argument("--instances", type=int, default=5,
+                        help="distinct Overseerr URLs among the rooms")
+    args = parser.parse_args()
+
+    imports = measure_import(args.iterations)
+    (inits, startups, first_command) = asyncio.run(
+        measure_init(args.iterations, args.rooms, args.instances))
+    print(f"{args.rooms} rooms on {args.instances} instances")
+    print(f"{'step':<14} {'p50 ms':>9} {'min ms':>9} {'max ms':>9}")
+    report("import", imports)
+    report("init", inits)
+    report("startup", startups)
+    report("first command", first_command)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    # Counts consecutive failed calls to an instance. Once the threshold
+    # is reached the breaker opens and calls fail right away, while the
+    # probe is retried in the background until the server is back.
+    def __init__(self, threshold, probe_interval, probe):
+        self.threshold = threshold
+        self.probe_interval = probe_interval
+        self.probe = probe
+        self.failures = 0
+        self.task = None
+
+    def is_open(self):
+        return self.failures >= self.threshold
+
+    def success(self):
+        self.failures = 0
+
+    def failure(self):
+        self.failures += 1
+        if self.is_open() and (self.task is None or self.task.done()):
+            logger.warning("server is not responding, pausing calls")
+            self.task = asyncio.create_task(self.run_probe())
+
+    async def run_probe(self):
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            try:
+                await self.probe()
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                logger.debug("server still not responding: %s", error)
+            else:
+                logger.info("server is responding again")
+                self.failures = 0
+                return
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
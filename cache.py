@@ -0,0 +1,98 @@
+import asyncio
+import functools
+import time
+from collections import OrderedDict
+
+from .admission import Urgency, get_priority, urgency
+
+
+MISSING = object()
+
+
+class Fetch:
+    __slots__ = ("task", "waiters", "urgency")
+
+    def __init__(self, fetch):
+        # The fetch is made as urgently as the most urgent caller needs
+        # it, not at the priority of whoever happened to start it.
+        self.urgency = Urgency(get_priority())
+        self.task = asyncio.ensure_future(self.run(fetch))
+        self.waiters = 0
+
+    async def run(self, fetch):
+        urgency.set(self.urgency)
+        return await fetch()
+
+
+class TTLCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        try:
+            (expires, value) = self.entries[key]
+        except KeyError:
+            return default
+        if expires < time.monotonic():
+            del self.entries[key]
+            return default
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def pop(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    async def get_or_fetch(self, key, fetch):
+        value = self.get(key, MISSING)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+
+        # Concurrent misses for the same key wait for a single fetch.
+        pending = self.pending.get(key)
+        if pending is None:
+            self.misses += 1
+            pending = Fetch(fetch)
+            pending.task.add_done_callback(
+                functools.partial(self.fetched, key, pending))
+            self.pending[key] = pending
+        else:
+            self.coalesced += 1
+            pending.urgency.raise_to(get_priority())
+
+        pending.waiters += 1
+        try:
+            return await asyncio.shield(pending.task)
+        finally:
+            pending.waiters -= 1
+            # Nobody is interested in the result anymore. Forget it
+            # right away, so that the next caller starts a new fetch
+            # instead of joining one that is being cancelled.
+            if not pending.waiters and not pending.task.done():
+                if self.pending.get(key) is pending:
+                    del self.pending[key]
+                pending.task.cancel()
+
+    def fetched(self, key, pending, task):
+        if self.pending.get(key) is pending:
+            del self.pending[key]
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result())
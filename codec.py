@@ -0,0 +1,69 @@
+import json
+
+
+# Use the fastest JSON library available, they're all optional.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+if orjson is not None:
+    NAME = "orjson"
+    loads = orjson.loads
+
+    def dumps(value):
+        return orjson.dumps(value).decode()
+elif ujson is not None:
+    NAME = "ujson"
+    loads = ujson.loads
+    dumps = ujson.dumps
+else:
+    NAME = "json"
+    loads = json.loads
+    dumps = json.dumps
+
+
+# Fields of API responses used by the flows and templates. A field
+# maps to None to be kept as it is, or to the fields to keep of it.
+DOWNLOAD_FIELDS = {"size": None, "sizeLeft": None, "timeLeft": None,
+                   "status": None, "estimatedCompletionTime": None}
+REQUEST_FIELDS = {
+    "id": None,
+    "status": None,
+    "type": None,
+    "createdAt": None,
+    "updatedAt": None,
+    "requestedBy": {"id": None, "displayName": None},
+    "media": {"id": None, "mediaType": None, "tmdbId": None,
+              "status": None, "downloadStatus": DOWNLOAD_FIELDS},
+}
+MEDIA_FIELDS = {
+    "id": None,
+    "mediaType": None,
+    "title": None,
+    "name": None,
+    "releaseDate": None,
+    "firstAirDate": None,
+    "overview": None,
+    "posterPath": None,
+    "voteAverage": None,
+    "voteCount": None,
+    "mediaInfo": {"status": None},
+}
+
+
+def project(value, fields):
+    # Copy of the value with only the given fields, lists are projected
+    # item by item.
+    if isinstance(value, list):
+        return [project(item, fields) for item in value]
+    if not isinstance(value, dict):
+        return value
+    return {name: value[name] if subfields is None
+            else project(value[name], subfields)
+            for name, subfields in fields.items() if name in value}
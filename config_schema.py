@@ -1,5 +1,5 @@
-from voluptuous import (Schema, All, Any, Required, Length, Url,
-                        ALLOW_EXTRA, MultipleInvalid)
+from voluptuous import (Schema, All, Any, Required, Length, Range, Url,
+                        Coerce, ALLOW_EXTRA, MultipleInvalid)
 
 
 # Not using opsdroid's CONFIG_SCHEMA feature because as of opsdroid 0.28.0,
@@ -8,6 +8,8 @@ from voluptuous import (Schema, All, Any, Required, Length, Url,
 
 
 str_nonempty = All(str, Length(min=1))
+int_positive = All(int, Range(min=1))
+seconds = All(Coerce(float), Range(min=0))
 schema = Schema({
     Required("bot-name", default="opsdroid"): str_nonempty,
     Required("bot-url"): Url(),
@@ -15,10 +17,44 @@ schema = Schema({
         str_nonempty: Any(Url(), {
             Required("url"): Url(),
             Required("more-rooms", default=[]): [str_nonempty],
+            Required("notify-rooms", default=[]): [str_nonempty],
+            Required("notify-types", default=[]): [str_nonempty],
             "api-key": str_nonempty,
         }),
     },
     "notify-room": str_nonempty,
+    Required("notify-window", default=3): seconds,
+    Required("notify-rate", default=20): int_positive,
+    Required("pool-size", default=100): int_positive,
+    Required("keepalive-timeout", default=30): seconds,
+    Required("concurrency", default=8): int_positive,
+    Required("metadata-cache-size", default=1000): int_positive,
+    Required("metadata-cache-ttl", default=3600): seconds,
+    Required("service-refresh-interval", default=3600): seconds,
+    Required("session-max-idle", default=3600): seconds,
+    Required("search-cache-size", default=200): int_positive,
+    Required("search-cache-ttl", default=300): seconds,
+    Required("page-size", default=100): int_positive,
+    Required("connect-timeout", default=5): seconds,
+    Required("read-timeout", default=30): seconds,
+    Required("retries", default=2): All(int, Range(min=0)),
+    Required("retry-backoff", default=0.5): seconds,
+    Required("breaker-threshold", default=5): int_positive,
+    Required("breaker-probe-interval", default=15): seconds,
+    Required("project-responses", default=True): bool,
+    Required("flow-max-pages", default=5): int_positive,
+    Required("max-active-calls", default=16): int_positive,
+    Required("max-queued-messages", default=5): int_positive,
+    Required("request-store", default=True): bool,
+    Required("store-reconcile-interval", default=3600): seconds,
+    Required("watch-interval", default=30): seconds,
+    Required("watch-max-interval", default=600): seconds,
+    Required("watch-step", default=25): All(Coerce(float),
+                                            Range(min=1, max=100)),
+    "template-cache": str_nonempty,
+    "poster-cache": str_nonempty,
+    "token-cache-ttl": seconds,
+    "poster-cache-size": int_positive,
 }, extra=ALLOW_EXTRA)
 
 
@@ -0,0 +1,173 @@
+import contextlib
+import re
+import time
+
+from aiohttp import web
+
+
+PATH_METRICS = "/overseerr/metrics"
+CONTENT_TYPE = "text/plain; version=0.0.4"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5, 5, 10, 30)
+
+
+def path_template(path):
+    # "/request/123/approve" -> "/request/{id}/approve"
+    return re.sub(r"/\d+(?=/|$)", "/{id}", path)
+
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\") \
+                     .replace("\n", "\\n") \
+                     .replace('"', '\\"')
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def expose(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self.samples()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield f"{self.name}{format_labels(self.labels, labels)} " \
+                  f"{format_value(value)}"
+
+
+class Gauge(Metric):
+    # Values are collected on scrape from a callback returning
+    # a dict of label tuples to values.
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=(), collect=None):
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+
+    def samples(self):
+        if self.collect is None:
+            return
+        for labels, value in self.collect().items():
+            yield f"{self.name}{format_labels(self.labels, labels)} " \
+                  f"{format_value(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.values = {}
+
+    def observe(self, value, *labels):
+        try:
+            (counts, total) = self.values[labels]
+        except KeyError:
+            counts = [0] * len(self.buckets)
+            total = 0.0
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+        self.values[labels] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self):
+        for labels, (counts, total) in self.values.items():
+            for bound, count in zip(self.buckets, counts):
+                le = f'le="{format_value(bound)}"'
+                yield f"{self.name}_bucket" \
+                      f"{format_labels(self.labels, labels, le)} {count}"
+            formatted = format_labels(self.labels, labels)
+            yield f"{self.name}_sum{formatted} {format_value(total)}"
+            yield f"{self.name}_count{formatted} {counts[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def expose(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+api_latency = registry.register(Histogram(
+    "overseerr_api_request_seconds",
+    "Latency of Overseerr API calls.",
+    ["method", "path"]))
+api_responses = registry.register(Counter(
+    "overseerr_api_responses_total",
+    "Overseerr API responses by status code.",
+    ["method", "path", "status"]))
+api_errors = registry.register(Counter(
+    "overseerr_api_errors_total",
+    "Failed Overseerr API calls by OverseerrError status.",
+    ["status"]))
+api_queue_wait = registry.register(Histogram(
+    "overseerr_api_queue_seconds",
+    "Time Overseerr API calls waited for a free slot.",
+    ["priority"]))
+webhook_latency = registry.register(Histogram(
+    "overseerr_webhook_seconds",
+    "Time spent handling notification webhooks."))
+render_latency = registry.register(Histogram(
+    "overseerr_template_render_seconds",
+    "Time spent rendering templates.",
+    ["template"]))
+
+
+class Metrics:
+    def __init__(self, web_app, registry=registry):
+        self.registry = registry
+        web_app.router.add_get(PATH_METRICS, self.handle_metrics)
+
+    async def handle_metrics(self, request):
+        return web.Response(text=self.registry.expose(),
+                            headers={"Content-Type": CONTENT_TYPE})
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import time
+
+from opsdroid.events import Message
+
+
+# Notification types which are merged into one message when several of
+# them arrive within the window.
+DIGEST_TYPES = {"MEDIA_PENDING", "MEDIA_APPROVED",
+                "MEDIA_DECLINED", "MEDIA_AVAILABLE"}
+
+
+logger = logging.getLogger(__name__)
+
+
+class RateBudget:
+    # Token bucket allowing `rate` messages per minute, in bursts of
+    # up to `rate` messages.
+    def __init__(self, rate):
+        self.capacity = rate
+        self.refill = rate / 60
+        self.tokens = rate
+        self.mtime = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.mtime) * self.refill)
+            self.mtime = now
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.refill)
+                self.tokens = 1
+                self.mtime = time.monotonic()
+            self.tokens -= 1
+
+
+class NotifyRoute:
+    def __init__(self, api, rooms, types=()):
+        self.api = api
+        self.rooms = tuple(rooms)
+        self.types = frozenset(types)
+
+    def accepts(self, notification_type):
+        return not self.types or notification_type in self.types
+
+
+class Notifier:
+    # Events are collected and rendered by one task, each room has its
+    # own task sending the messages within the room's budget, so a busy
+    # room doesn't hold up the others.
+    def __init__(self, opsdroid, templates, window, rate):
+        self.opsdroid = opsdroid
+        self.templates = templates
+        self.window = window
+        self.rate = rate
+        self.outboxes = {}
+        self.senders = {}
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        for task in self.senders.values():
+            task.cancel()
+        self.senders = {}
+        self.outboxes = {}
+
+    def push(self, route, data):
+        self.queue.put_nowait((route, data))
+
+    async def run(self):
+        while True:
+            batch = [await self.queue.get()]
+            # Collect whatever else arrives within the window.
+            deadline = time.monotonic() + self.window
+            while True:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(),
+                                                        timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            groups = {}
+            for (route, data) in batch:
+                key = (route.api, route.rooms, data.get("notification_type"))
+                groups.setdefault(key, []).append(data)
+
+            await asyncio.gather(*(self.deliver(api, rooms, kind, events)
+                                   for (api, rooms, kind), events
+                                   in groups.items()))
+
+    async def deliver(self, api, rooms, kind, events):
+        # Render once, then queue the messages for all the rooms.
+        try:
+            if kind in DIGEST_TYPES and len(events) > 1:
+                texts = [await self.templates.render(
+                    "notify_digest.jinja", events=events, api=api,
+                    notification_type=kind)]
+            else:
+                texts = [await self.templates.render("notify.jinja", data,
+                                                     api=api)
+                         for data in events]
+        except Exception:
+            logger.exception("failed to render %s notifications", kind)
+            return
+
+        for room in rooms:
+            outbox = self.outboxes.get(room)
+            if outbox is None:
+                outbox = self.outboxes[room] = asyncio.Queue()
+                self.senders[room] = asyncio.create_task(
+                    self.send(room, outbox))
+            for text in texts:
+                outbox.put_nowait(text)
+
+    async def send(self, room, outbox):
+        budget = RateBudget(self.rate)
+        while True:
+            text = await outbox.get()
+            await budget.acquire()
+            try:
+                await self.opsdroid.send(Message(text, target=room))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("failed to deliver notifications to %s",
+                                 room)
@@ -1,9 +1,12 @@
 import platform
+import time
 import urllib.parse
 
 import aiohttp
 from aiohttp import web
 
+from . import codec
+
 
 PATH_LOGIN = "/plex/login"
 PATH_AUTH = "/plex/auth"
@@ -11,10 +14,15 @@ HTTP_NOT_FOUND = 404
 
 
 class Plex:
-    def __init__(self, product, base_url, web_app, memory, jinja):
+    def __init__(self, product, base_url, web_app, memory, templates,
+                 token_ttl=None):
         self.base_url = base_url
         self.memory = memory
-        self.jinja = jinja
+        # Write-through cache of the tokens in memory, including users
+        # without one. Entries never expire if token_ttl is None.
+        self.token_ttl = token_ttl
+        self.tokens = {}
+        self.templates = templates
         self.product = product
         web_app.router.add_get(PATH_LOGIN, self.handle_login)
         web_app.router.add_get(PATH_AUTH, self.handle_auth)
@@ -34,9 +42,9 @@ class Plex:
         forward_url = f"{self.base_url}{PATH_AUTH}?{query}"
 
         headers = self.get_headers(user_id)
-        tmpl = self.jinja.get_template("plex/login.html.jinja")
-        body = await tmpl.render_async({}, headers=headers,
-                                       forward_url=forward_url)
+        body = await self.templates.render("plex/login.html.jinja",
+                                           headers=headers,
+                                           forward_url=forward_url)
         return web.Response(body=body, content_type="text/html")
 
     async def handle_auth(self, request):
@@ -59,18 +67,36 @@ class Plex:
         await self.set_auth_token(user_id, auth_token)
 
         headers = self.get_headers(user_id)
-        tmpl = self.jinja.get_template("plex/auth.html.jinja")
-        body = await tmpl.render_async({}, headers=headers)
+        body = await self.templates.render("plex/auth.html.jinja",
+                                           headers=headers)
         return web.Response(body=body, content_type="text/html")
 
     async def get_auth_token(self, user_id):
-        return await self.memory.get(auth_token_key(user_id))
+        try:
+            (auth_token, expires) = self.tokens[user_id]
+        except KeyError:
+            pass
+        else:
+            if expires is None or expires > time.monotonic():
+                return auth_token
+        auth_token = await self.memory.get(auth_token_key(user_id))
+        self.remember_auth_token(user_id, auth_token)
+        return auth_token
 
     async def set_auth_token(self, user_id, auth_token):
         await self.memory.put(auth_token_key(user_id), auth_token)
+        self.remember_auth_token(user_id, auth_token)
 
     async def delete_auth_token(self, user_id):
         await self.memory.delete(auth_token_key(user_id))
+        self.remember_auth_token(user_id, None)
+
+    def remember_auth_token(self, user_id, auth_token):
+        if self.token_ttl is None:
+            expires = None
+        else:
+            expires = time.monotonic() + self.token_ttl
+        self.tokens[user_id] = (auth_token, expires)
 
     def get_headers(self, user_id):
         return {
@@ -90,7 +116,7 @@ class Plex:
         async with aiohttp.ClientSession(headers=headers,
                                         raise_for_status=True) as session:
             response = await session.get(f"https://plex.tv/api/v2/pins/{pin_id}")
-            return await response.json()
+            return await response.json(loads=codec.loads)
 
 
 def auth_token_key(user_id):
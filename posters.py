@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+from collections import OrderedDict
+
+import aiohttp
+from aiohttp import web
+
+from opsdroid.events import Message, Image
+
+
+PATH_POSTER = "/overseerr/poster/{size}/{name}"
+TMDB_URL = "https://image.tmdb.org/t/p/{size}/{name}"
+# Sizes offered by TMDB, smaller ones serve as thumbnails.
+SIZES = {"w92", "w154", "w185", "w342", "w500", "w780", "original",
+         "w600_and_h900_bestv2"}
+DEFAULT_SIZE = "w600_and_h900_bestv2"
+VALID_NAME = re.compile(r"[A-Za-z0-9_-]+\.(jpg|jpeg|png)$")
+MAX_AGE = 7 * 24 * 3600
+# Default cache sizes in bytes, memory is much more precious than disk.
+DEFAULT_DISK_BYTES = 100 * 1024 * 1024
+DEFAULT_MEMORY_BYTES = 10 * 1024 * 1024
+
+
+logger = logging.getLogger(__name__)
+
+
+class Poster:
+    __slots__ = ("data", "path", "size", "etag")
+
+    def __init__(self, data, path, size, etag):
+        self.data = data
+        self.path = path
+        self.size = size
+        self.etag = etag
+
+
+class PosterCache:
+    # LRU cache of TMDB posters, bounded by total size. Kept on disk when
+    # a directory is given, in memory otherwise. Also served by the web
+    # server so that posters can be handed out as URLs.
+    def __init__(self, web_app, cache_dir=None, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = DEFAULT_DISK_BYTES if cache_dir \
+                else DEFAULT_MEMORY_BYTES
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.total = 0
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.session = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.load_index()
+        web_app.router.add_get(PATH_POSTER, self.handle_poster)
+
+    async def get_cover(self, poster_path):
+        # Response for the «cover» commands.
+        if not poster_path:
+            return Message("No cover image available")
+        name = poster_path.rsplit("/", 1)[-1]
+        try:
+            (_, data) = await self.load(DEFAULT_SIZE, name)
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as error:
+            logger.warning("failed to get poster %s: %s", name, error)
+            url = TMDB_URL.format(size=DEFAULT_SIZE, name=name)
+            return Image(name=name, url=url)
+        return Image(file_bytes=data, name=name, mimetype=mimetype(name))
+
+    async def handle_poster(self, request):
+        size = request.match_info["size"]
+        name = request.match_info["name"]
+        if size not in SIZES or not VALID_NAME.match(name):
+            raise web.HTTPNotFound()
+
+        try:
+            poster = await self.get(size, name)
+            if poster.etag in request.headers.get("If-None-Match", ""):
+                return web.Response(status=304, headers=get_headers(poster))
+            (poster, data) = await self.load(size, name)
+        except aiohttp.ClientResponseError as error:
+            raise web.HTTPNotFound() if error.status == 404 \
+                else web.HTTPBadGateway()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            raise web.HTTPBadGateway()
+        except OSError:
+            raise web.HTTPServiceUnavailable()
+        return web.Response(body=data, headers=get_headers(poster),
+                            content_type=mimetype(name))
+
+    async def load(self, size, name):
+        # A file evicted or removed since get() counts as a miss.
+        poster = await self.get(size, name)
+        try:
+            return (poster, await self.read(poster))
+        except OSError:
+            self.discard(size, name, poster)
+        poster = await self.get(size, name)
+        return (poster, await self.read(poster))
+
+    async def get(self, size, name):
+        key = (size, name)
+        try:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        except KeyError:
+            pass
+
+        # Concurrent requests for the same poster share one download.
+        task = self.pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.download(size, name))
+            self.pending[key] = task
+            task.add_done_callback(lambda task: self.pending.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def download(self, size, name):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(raise_for_status=True)
+        url = TMDB_URL.format(size=size, name=name)
+        async with self.session.get(url) as resp:
+            data = await resp.read()
+        return await self.store(size, name, data)
+
+    async def store(self, size, name, data):
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, f"{size}-{name}")
+            loop = asyncio.get_running_loop()
+            stat = await loop.run_in_executor(None, write_file, path, data)
+            poster = Poster(None, path, len(data), file_etag(stat))
+        else:
+            etag = '"{}"'.format(hashlib.sha1(data).hexdigest()[:20])
+            poster = Poster(data, None, len(data), etag)
+
+        self.entries[size, name] = poster
+        self.total += poster.size
+        self.evict()
+        return poster
+
+    async def read(self, poster):
+        if poster.data is not None:
+            return poster.data
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, read_file, poster.path)
+
+    def discard(self, size, name, poster):
+        if self.entries.get((size, name)) is poster:
+            del self.entries[size, name]
+            self.total -= poster.size
+
+    def evict(self):
+        while self.total > self.max_bytes and len(self.entries) > 1:
+            (_, poster) = self.entries.popitem(last=False)
+            self.total -= poster.size
+            if poster.path:
+                try:
+                    os.remove(poster.path)
+                except OSError:
+                    pass
+
+    def load_index(self):
+        # Pick up posters cached before a restart, oldest first.
+        # Only the directory is listed, the files are read when used.
+        files = []
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                (size, _, name) = entry.name.partition("-")
+                if size in SIZES and VALID_NAME.match(name):
+                    files.append((entry.stat(), size, name, entry.path))
+        for (stat, size, name, path) in sorted(
+                files, key=lambda file: file[0].st_mtime_ns):
+            self.entries[size, name] = Poster(None, path, stat.st_size,
+                                              file_etag(stat))
+            self.total += stat.st_size
+        self.evict()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+def get_headers(poster):
+    return {"ETag": poster.etag, "Cache-Control": f"public, max-age={MAX_AGE}"}
+
+
+def mimetype(name):
+    return "image/png" if name.endswith(".png") else "image/jpeg"
+
+
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def write_file(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return os.stat(path)
+
+
+def file_etag(stat):
+    # Changes whenever the file is written again, without reading it.
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
@@ -0,0 +1,123 @@
+import bisect
+import sys
+from collections import OrderedDict
+from operator import attrgetter
+
+from . import codec
+
+
+# Records keep only what the templates and commands use from the API's
+# results. Attribute names follow the API so that the templates work
+# the same with records and plain responses.
+
+
+class SearchResult:
+    __slots__ = ("index", "id", "mediaType", "title", "name",
+                 "releaseDate", "firstAirDate", "voteAverage", "voteCount",
+                 "overview", "posterPath", "mediaInfo")
+
+    def __init__(self, index, result):
+        self.index = index
+        self.id = result["id"]
+        self.mediaType = result["mediaType"]
+        self.title = result.get("title")
+        self.name = result.get("name")
+        self.releaseDate = result.get("releaseDate")
+        self.firstAirDate = result.get("firstAirDate")
+        self.voteAverage = result.get("voteAverage")
+        self.voteCount = result.get("voteCount")
+        self.overview = result.get("overview")
+        self.posterPath = result.get("posterPath")
+        self.mediaInfo = codec.project(result.get("mediaInfo"),
+                                       codec.MEDIA_FIELDS["mediaInfo"])
+
+
+class RequestResult:
+    __slots__ = ("index", "id", "status", "createdAt", "requestedBy",
+                 "media", "info")
+
+    def __init__(self, index, request, info=None):
+        self.index = index
+        self.info = info
+        self.update(request)
+
+    def update(self, request):
+        fields = codec.REQUEST_FIELDS
+        self.id = request["id"]
+        self.status = request.get("status")
+        self.createdAt = request.get("createdAt")
+        self.requestedBy = codec.project(request.get("requestedBy"),
+                                         fields["requestedBy"])
+        self.media = codec.project(request["media"], fields["media"])
+
+
+class ResultPages:
+    # Results of a flow, numbered from 0, in the pages they were shown
+    # in. Only the last `max_pages` pages used are kept, the others are
+    # loaded again with `await load(number, start, keys)` when needed,
+    # where keys identify the records that were shown. Records that
+    # aren't there anymore, or that aren't the ones shown, come back as
+    # None.
+    def __init__(self, max_pages, load, key=attrgetter("id")):
+        self.max_pages = max_pages
+        self.load = load
+        self.key = key
+        self.starts = []
+        self.keys = []
+        self.pages = OrderedDict()
+
+    def __len__(self):
+        if not self.starts:
+            return 0
+        return self.starts[-1] + len(self.keys[-1])
+
+    def add(self, records):
+        number = len(self.starts)
+        self.starts.append(len(self))
+        self.keys.append(tuple(self.key(record) for record in records))
+        self.keep(number, records)
+
+    def keep(self, number, records):
+        self.pages[number] = records
+        self.pages.move_to_end(number)
+        while len(self.pages) > self.max_pages:
+            self.pages.popitem(last=False)
+
+    async def get(self, index):
+        number = bisect.bisect_right(self.starts, index) - 1
+        start = self.starts[number]
+        records = self.pages.get(number)
+        if records is None:
+            keys = self.keys[number]
+            loaded = list(await self.load(number, start, keys))
+            loaded.extend([None] * (len(keys) - len(loaded)))
+            records = [record if record is not None
+                       and self.key(record) == key else None
+                       for record, key in zip(loaded, keys)]
+        self.keep(number, records)
+        return records[index - start]
+
+    async def select(self, indexes):
+        records = [await self.get(index) for index in indexes]
+        return [record for record in records if record is not None]
+
+    def get_size(self):
+        # Rough number of bytes held by the pages in memory.
+        return get_size(list(self.pages.values()), set())
+
+
+def get_size(value, seen):
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += get_size(key, seen) + get_size(item, seen)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += get_size(item, seen)
+    elif hasattr(value, "__slots__"):
+        for name in value.__slots__:
+            size += get_size(getattr(value, name, None), seen)
+    return size
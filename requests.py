@@ -1,25 +1,42 @@
-import regex
+import logging
 
-from opsdroid.events import Message, Typing, Image
+from opsdroid.events import Message, Typing
 
-from .api import MediaStatus
-from .utils import index_parser
+from .api import MediaStatus, OverseerrError
+from .records import RequestResult, ResultPages
+from .utils import index_parser, parse_selection, gather_limited
+
+
+KINDS = "all approved available pending processing unavailable failed".split()
+HTTP_NOT_FOUND = 404
+
+
+logger = logging.getLogger(__name__)
 
 
 async def requests_flow(message, context):
+    store = get_store(context)
     kind = (message.regex.group("kind") or "all").strip().lower()
-    valid = "all approved available pending processing unavailable failed".split()
-    match = [name for name in valid if name.startswith(kind)]
+    match = [name for name in KINDS if name.startswith(kind)]
+    title = None
     if len(match) == 1:
         kind = match[0]
+    elif store is not None and not match:
+        # With a local copy of the requests, they can also be looked
+        # up by title.
+        title = kind
     else:
         text = f"Sorry, '{kind}' does not uniquely identify a valid request type. " \
-                f"Request types are:\n{', '.join(valid)}"
+                f"Request types are:\n{', '.join(KINDS)}"
         await message.respond(Message(text))
         return
 
+    take = message.regex.group("take")
+    if title is not None and take and not take.strip().isdigit():
+        title = f"{title} {take.strip()}"
+        take = None
     try:
-        take = int(message.regex.group("take") or 10)
+        take = int(take or 10)
     except ValueError:
         text = "Sorry, the count must be a number"
         await message.respond(Message(text))
@@ -27,42 +44,69 @@ async def requests_flow(message, context):
     if take < 1:
         take = 1
 
+    if title is not None:
+        stream = store.iter_requests(title=title)
+    elif store is not None:
+        stream = store.iter_requests(kind)
+    else:
+        stream = context.session.iter_requests(page_size=take, kind=kind)
+
+    async def load_page(number, start, ids):
+        # By id, the list may have changed since the page was shown.
+        if store is not None:
+            requests = [store.requests.get(request_id) for request_id in ids]
+        else:
+            requests = await reload_requests(context, start, ids, kind)
+        return await make_results(context.session, requests, start)
+
+    try:
+        await browse_requests(message, context, stream, title or kind,
+                              take, load_page)
+    finally:
+        stream.close()
+
+
+async def browse_requests(message, context, stream, kind, take, load_page):
+    # Imported on first use to keep loading the skill quick.
+    import regex
+
     load_more = True
-    all_results = []
+    all_results = ResultPages(context.max_pages, load_page)
+    context.results = all_results
     selected = None
     while True:
         if load_more:
             await message.respond(Typing(True))
             skip = len(all_results)
-            response = await context.session.list_requests(take=take, skip=skip, kind=kind)
-            total = response["pageInfo"]["results"]
-            results = response["results"]
-
-            for index, result in enumerate(results, len(all_results) + 1):
-                result["index"] = index
-                result["info"] = await context.session.get_info(result["media"])
-
-            all_results.extend(results)
+            results = await make_results(context.session,
+                                         await stream.take(take), skip)
+            total = stream.total
+            all_results.add(results)
             load_more = False
 
             if len(all_results) != 1:
-                tmpl = context.jinja.get_template("requests/results.jinja")
-                text = await tmpl.render_async({}, results=results, skip=skip,
-                                                kind=kind, total=total)
+                text = await context.templates.render(
+                    "requests/results.jinja", results=results, skip=skip,
+                    kind=kind, total=total)
                 await message.respond(Message(text))
 
         if not all_results:
             return
 
-        result_parser = index_parser(all_results)
+        result_parser = index_parser(range(len(all_results)))
         def parser(message):
             text = message.text
 
             if regex.match(r"m(ore)?$", text, regex.I):
                 return ("more", None)
 
+            match = regex.match(r"(?P<command>del(ete)?|d(ecline)?|a(pprove)?|r(etry)?)"
+                                r"\s+(?P<selection>.+)$", text, regex.I)
+            if match:
+                return ("batch", match)
+
             if selected:
-                if selected["media"]["status"] == MediaStatus.PENDING:
+                if selected.media["status"] == MediaStatus.PENDING:
                     if regex.match(r"a(pprove)?$", text, regex.I):
                         return ("approve", selected)
                     if regex.match(r"d(ecline)?$", text, regex.I):
@@ -70,6 +114,10 @@ async def requests_flow(message, context):
 
                 if regex.match(r"c(over)?$", text, regex.I):
                     return ("cover", selected)
+                if regex.match(r"w(atch)?$", text, regex.I):
+                    return ("watch", selected)
+                if regex.match(r"unw(atch)?$", text, regex.I):
+                    return ("unwatch", selected)
                 if regex.match(r"r(etry)?$", text, regex.I):
                     return ("retry", selected)
                 if regex.match(r"del(ete)?$", text, regex.I):
@@ -80,42 +128,65 @@ async def requests_flow(message, context):
                 return ("result", result)
 
         if not selected and len(all_results) == 1:
-            (command, argument) = ("result", all_results[0])
+            (command, argument) = ("result", 0)
         else:
             (command, argument) = await context.get_and_parse(parser, ("away", None))
 
         if command == "result":
-            selected = argument
-
+            selected = await all_results.get(argument)
             # Refresh in case it's downloading and there's new data.
-            update = await context.session.get_request(selected["id"])
-            selected.update(update)
+            if selected is not None:
+                update = await get_request(context.session, selected.id)
+                if update is None:
+                    selected = None
+                else:
+                    selected.update(update)
+            if selected is None:
+                text = "Sorry, that request isn't there anymore"
+                await message.respond(Message(text))
+                continue
 
-            tmpl = context.jinja.get_template("requests/details.jinja")
-            text = await tmpl.render_async({}, result=selected, api=context.session.api)
+            text = await context.templates.render(
+                "requests/details.jinja", result=selected, api=context.session.api)
             await message.respond(Message(text))
 
             actions = ["see the «cover»"]
-            status = selected["media"]["status"]
+            status = selected.media["status"]
             if status == MediaStatus.PENDING:
                 actions.extend(["«approve»", "«decline»"])
+            if context.watcher.is_watching(selected.id, message.target):
+                actions.append("«unwatch»")
+            elif status == MediaStatus.PROCESSING:
+                actions.append("«watch» the download")
             actions.append("«retry»")
             text = f"Would you like to {', '.join(actions)} or «delete» this request?"
             await message.respond(Message(text))
 
         elif command == "cover":
-            poster_path = argument["info"].get("posterPath")
-            if poster_path:
-                name = poster_path.rsplit("/", 1)[-1]
-                url = "https://image.tmdb.org/t/p/w600_and_h900_bestv2" + poster_path
-                response = Image(name=name, url=url)
-            else:
-                response = Message("No cover image available")
+            poster_path = argument.info.get("posterPath")
+            response = await context.posters.get_cover(poster_path)
             await message.respond(response)
 
+        elif command == "watch":
+            if argument.media["status"] == MediaStatus.PROCESSING:
+                context.watcher.watch(argument, message.target,
+                                      message.user_id,
+                                      context.session.authenticator)
+                text = "OK, I'll let you know how the download is going"
+            else:
+                text = "Only requests that are being processed can be watched"
+            await message.respond(Message(text))
+
+        elif command == "unwatch":
+            if context.watcher.unwatch(argument.id, message.target):
+                text = "OK, no more download updates for this one"
+            else:
+                text = "This request isn't being watched"
+            await message.respond(Message(text))
+
         elif command in {"approve", "decline", "retry"}:
             await message.respond(Typing(True))
-            await context.session.update_request_status(argument["id"], command)
+            await context.session.update_request_status(argument.id, command)
             if command == "approve":
                 text = "OK, request has been approved"
             elif command == "decline":
@@ -126,12 +197,151 @@ async def requests_flow(message, context):
 
         elif command == "delete":
             await message.respond(Typing(True))
-            await context.session.delete_request(argument["id"])
+            await context.session.delete_request(argument.id)
             text = "OK, request deleted"
             await message.respond(Message(text))
 
+        elif command == "batch":
+            await batch_command(message, context, argument, all_results)
+
         elif command == "more":
             load_more = True
 
         elif command == "away":
             return
+
+
+async def batch_command(message, context, match, all_results):
+    command = match.group("command").lower()
+    if command.startswith("del"):
+        command = "delete"
+    else:
+        command = {"a": "approve", "d": "decline", "r": "retry"}[command[0]]
+
+    # Select from the listed requests or, with "all <type>",
+    # from all requests of that type on the server.
+    selection = match.group("selection").strip().lower()
+    words = selection.split()
+    kind = None
+    if words and words[0] == "all" and len(words) <= 2:
+        if len(words) == 1:
+            targets = await all_results.select(range(len(all_results)))
+        elif words[1] in KINDS:
+            await message.respond(Typing(True))
+            kind = words[1]
+            targets = await list_all_requests(context, kind)
+        else:
+            targets = None
+    else:
+        indexes = parse_selection(selection)
+        if indexes and indexes[-1] >= len(all_results):
+            count = len(all_results)
+            text = f"Sorry, '{selection}' is out of range, there " \
+                   f"{'are' if count != 1 else 'is'} only {count} " \
+                   f"request{'s' if count != 1 else ''} listed"
+            await message.respond(Message(text))
+            return
+        if indexes is None:
+            targets = None
+        else:
+            targets = await all_results.select(indexes)
+
+    if targets is None:
+        text = f"Sorry, I don't understand '{selection}'. Try something " \
+               f"like «{command} 1-5», «{command} 3,5,9» or «{command} all pending»"
+        await message.respond(Message(text))
+        return
+
+    # Requests beyond the listing, make sure that's what the user wants.
+    if kind is not None and targets:
+        count = len(targets)
+        text = f"This will {command} {count} " \
+               f"{'' if kind == 'all' else kind + ' '}" \
+               f"request{'s' if count != 1 else ''} on the server, not " \
+               f"just the listed ones. Say «yes» to go ahead"
+        await message.respond(Message(text))
+        confirmed = await context.get_and_parse(
+            lambda message: message.text.strip().lower() in ("y", "yes"))
+        if not confirmed:
+            text = "OK, nothing has been changed"
+            await message.respond(Message(text))
+            return
+
+    await message.respond(Typing(True))
+    if command == "delete":
+        action = context.session.delete_request
+    else:
+        action = lambda request_id: \
+            context.session.update_request_status(request_id, command)
+    outcomes = await gather_limited(
+        context.api.settings.concurrency,
+        (action(target.id) for target in targets),
+        return_exceptions=True)
+
+    failed = []
+    for target, outcome in zip(targets, outcomes):
+        if isinstance(outcome, OverseerrError):
+            failed.append((target, outcome.message or outcome.reason))
+        elif isinstance(outcome, BaseException):
+            logger.error("batch %s of request %s failed: %r",
+                         command, target.id, outcome)
+            failed.append((target, "something went wrong"))
+
+    text = await context.templates.render(
+        "requests/batch.jinja", command=command, total=len(targets),
+        failed=failed)
+    await message.respond(Message(text))
+
+
+def get_store(context):
+    # The store can be used once it has been loaded.
+    store = context.api.store
+    if store is not None and store.ready:
+        return store
+
+
+async def list_all_requests(context, kind):
+    store = get_store(context)
+    if store is not None:
+        stream = store.iter_requests(kind)
+    else:
+        stream = context.session.iter_requests(kind=kind)
+    try:
+        return [RequestResult(None, request) async for request in stream]
+    finally:
+        stream.close()
+
+
+async def reload_requests(context, start, ids, kind):
+    # The page at the same place, with the requests that moved away
+    # looked up one by one. Those that are gone come back as None.
+    session = context.session
+    response = await session.list_requests(take=len(ids), skip=start,
+                                           kind=kind)
+    found = {request["id"]: request for request in response["results"]}
+    missing = [request_id for request_id in ids if request_id not in found]
+    requests = await gather_limited(
+        context.api.settings.concurrency,
+        (get_request(session, request_id) for request_id in missing))
+    found.update(zip(missing, requests))
+    return [found[request_id] for request_id in ids]
+
+
+async def get_request(session, request_id):
+    try:
+        return await session.get_request(request_id)
+    except OverseerrError as error:
+        if error.status == HTTP_NOT_FOUND:
+            return None
+        raise
+
+
+async def make_results(session, requests, skip):
+    # Records numbered from skip + 1, with the media details. Requests
+    # that are gone (None) keep their number but have no record.
+    present = [request for request in requests if request is not None]
+    infos = iter(await session.get_infos([request["media"]
+                                          for request in present]))
+    return [None if request is None
+            else RequestResult(index, request, next(infos))
+            for index, request in enumerate(requests, skip + 1)]
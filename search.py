@@ -1,52 +1,94 @@
-import regex
+import contextlib
+from operator import attrgetter
 
-from opsdroid.events import Message, Typing, Image
+from opsdroid.events import Message, Typing
 
-from .api import MediaStatus
-from .utils import index_parser
+from .admission import run_in_background
+from .api import MediaStatus, OverseerrError
+from .records import SearchResult, ResultPages
+from .utils import gather_limited, index_parser
+
+
+MEDIA_TYPES = {"movie", "tv"}
 
 
 async def search_flow(message, context):
-    term = (message.regex.group("term") or "").strip()
+    # Imported on first use to keep loading the skill quick.
+    import regex
+
+    text = (message.regex.group("term") or "").strip()
 
-    if not term:
+    if not text:
         text = "What is the name of the movie or TV show you want to search for?"
         await message.respond(Message(text))
         message = await context.get()
-        term = message.text.strip()
+        text = message.text.strip()
         context.touch()
 
+    # Several titles can be searched at once, one per line or separated
+    # with semicolons.
+    terms = [term.strip() for term in regex.split(r"[;\n]", text)]
+    terms = list(dict.fromkeys(term for term in terms if term))
+    if not terms:
+        return
+
+    async def search_all(terms, page, skip):
+        searches = await gather_limited(
+            context.api.settings.concurrency,
+            [context.session.search(term, page=page) for term in terms])
+        groups = []
+        for term, search in zip(terms, searches):
+            results = make_results(search, skip)
+            skip += len(results)
+            groups.append((term, search, results))
+        return groups
+
+    # Terms searched for each page, to load it again if needed. Results
+    # that moved in the meantime are dropped by their key.
+    page_terms = []
+    async def load_page(number, start, keys):
+        groups = await search_all(page_terms[number], number + 1, start)
+        return [result for (_, _, results) in groups for result in results]
+
     page = 0
     load_more = True
-    all_results = []
+    active_terms = terms
+    shown = dict.fromkeys(terms, 0)
+    all_results = ResultPages(context.max_pages, load_page,
+                              key=attrgetter("mediaType", "id"))
+    context.results = all_results
     selected = None
     while True:
         if load_more:
-            await message.respond(Typing(True))
-            page += 1
-            search = await context.session.search(term, page=page)
-            # Filter out movies and tv shows.
-            results = [r for r in search["results"]
-                        if r["mediaType"] in {"movie", "tv"}]
-
-            for index, result in enumerate(results, len(all_results) + 1):
-                result["index"] = index
-
-            total = search["totalResults"]
-            skip = len(all_results)
-            all_results.extend(results)
             load_more = False
-
-            if len(all_results) != 1:
-                tmpl = context.jinja.get_template("search/results.jinja")
-                text = await tmpl.render_async({}, results=results, term=term,
-                                            skip=skip, total=total)
-                await message.respond(Message(text))
+            if not active_terms:
+                await message.respond(Message("There are no more results, sorry"))
+            else:
+                await message.respond(Typing(True))
+                page += 1
+                skip = len(all_results)
+                groups = await search_all(active_terms, page, skip)
+                page_terms.append(active_terms)
+                all_results.add([result for (_, _, results) in groups
+                                 for result in results])
+
+                # Load the next pages while the user reads this one.
+                active_terms = [term for (term, search, _) in groups
+                                if page < search["totalPages"]]
+                for term in active_terms:
+                    context.spawn(prefetch(context.session, term, page + 1))
+
+                if len(all_results) != 1:
+                    text = await render_results(context, groups, shown, skip,
+                                                bool(active_terms))
+                    await message.respond(Message(text))
+                for (term, _, results) in groups:
+                    shown[term] += len(results)
 
         if not all_results:
             return
 
-        result_parser = index_parser(all_results)
+        result_parser = index_parser(range(len(all_results)))
         def parser(message):
             text = message.text
 
@@ -65,28 +107,27 @@ async def search_flow(message, context):
                 return ("result", result)
 
         if not selected and len(all_results) == 1:
-            (command, argument) = ("result", all_results[0])
+            (command, argument) = ("result", 0)
         else:
             (command, argument) = await context.get_and_parse(parser, ("away", None))
 
         if command == "result":
-            selected = argument
+            selected = await all_results.get(argument)
+            if selected is None:
+                text = "Sorry, that result isn't there anymore"
+                await message.respond(Message(text))
+                continue
 
-            tmpl = context.jinja.get_template("search/details.jinja")
-            text = await tmpl.render_async({}, result=selected, api=context.session.api)
+            text = await context.templates.render(
+                "search/details.jinja", result=selected, api=context.session.api)
             await message.respond(Message(text))
 
             text = "Would you like to see the «cover» or «request» the media?"
             await message.respond(Message(text))
 
         elif command == "cover":
-            poster_path = argument.get("posterPath")
-            if poster_path:
-                name = poster_path.rsplit("/", 1)[-1]
-                url = "https://image.tmdb.org/t/p/w600_and_h900_bestv2" + poster_path
-                response = Image(name=name, url=url)
-            else:
-                response = Message("No cover image available")
+            poster_path = argument.posterPath
+            response = await context.posters.get_cover(poster_path)
             await message.respond(response)
 
         elif command == "request":
@@ -101,6 +142,34 @@ async def search_flow(message, context):
             return
 
 
+async def render_results(context, groups, shown, skip, more):
+    if len(groups) == 1:
+        (term, search, results) = groups[0]
+        return await context.templates.render(
+            "search/results.jinja", results=results, term=term,
+            skip=shown[term], total=search["totalResults"])
+    groups = [{"term": term, "results": results, "skip": shown[term],
+               "total": search["totalResults"]}
+              for (term, search, results) in groups]
+    return await context.templates.render(
+        "search/groups.jinja", groups=groups, skip=skip, more=more)
+
+
+def make_results(search, skip):
+    # Only movies and tv shows, numbered from skip + 1.
+    results = [result for result in search["results"]
+               if result["mediaType"] in MEDIA_TYPES]
+    return [SearchResult(index, result)
+            for index, result in enumerate(results, skip + 1)]
+
+
+async def prefetch(session, term, page):
+    # Errors will surface if the user actually asks for the page.
+    run_in_background()
+    with contextlib.suppress(Exception):
+        await session.search(term, page=page)
+
+
 async def request_flow(message, context, selected, params):
     # Parse the params.
     params = params.split(' in ', 1)
@@ -111,9 +180,7 @@ async def request_flow(message, context, selected, params):
         folder = ""
 
     # Abort if media already requested.
-    print(selected)
-    status = selected.get("mediaInfo", {}) \
-                     .get("status", MediaStatus.UNKNOWN)
+    status = (selected.mediaInfo or {}).get("status", MediaStatus.UNKNOWN)
     if status in (MediaStatus.PENDING,
                   MediaStatus.PROCESSING,
                   MediaStatus.AVAILABLE):
@@ -121,11 +188,13 @@ async def request_flow(message, context, selected, params):
         await message.respond(Message(text))
         return
 
-    # Get server info depending on media type.
-    if selected["mediaType"] == "tv":
-        server_info = await context.session.get_sonarr_server(0)
-    else:
-        server_info = await context.session.get_radarr_server(0)
+    # Get the default server for the media type.
+    server_info = await context.api.services.get_server(
+        context.session, selected.mediaType)
+    if server_info is None:
+        text = "Sorry, there is no server configured for this type of media"
+        await message.respond(Message(text))
+        return
 
     # If provided in params, match the quality with profile names.
     profile = None
@@ -142,8 +211,7 @@ async def request_flow(message, context, selected, params):
 
     # Still no profile? Ask which one to use.
     if profile is None:
-        tmpl = context.jinja.get_template("request/profile.jinja")
-        text = await tmpl.render_async(server_info)
+        text = await context.templates.render("request/profile.jinja", server_info)
         await message.respond(Message(text))
         parser = index_parser(server_info["profiles"])
         profile = await context.get_and_parse(parser)
@@ -165,8 +233,7 @@ async def request_flow(message, context, selected, params):
 
     # Still no root folder path? Ask which one to use.
     if root_folder is None:
-        tmpl = context.jinja.get_template("request/folder.jinja")
-        text = await tmpl.render_async(server_info)
+        text = await context.templates.render("request/folder.jinja", server_info)
         await message.respond(Message(text))
         parser = index_parser(server_info["rootFolders"])
         root_folder = await context.get_and_parse(parser)
@@ -175,14 +242,19 @@ async def request_flow(message, context, selected, params):
 
     # Finally, request the media!
     await message.respond(Typing(True))
-    data = await context.session.request(
-        selected["mediaType"],
-        selected["id"],
-        server_id=0,
-        profile_id=profile["id"],
-        root_folder=root_folder["path"])
-
-    tmpl = context.jinja.get_template("request/done.jinja")
-    text = await tmpl.render_async(data, result=selected, profile=profile,
-                                    root_folder=root_folder)
+    try:
+        data = await context.session.request(
+            selected.mediaType,
+            selected.id,
+            server_id=server_info["server"]["id"],
+            profile_id=profile["id"],
+            root_folder=root_folder["path"])
+    except OverseerrError:
+        # Profiles or folders may have changed on the server.
+        context.api.services.refresh_soon(context.session)
+        raise
+
+    text = await context.templates.render(
+        "request/done.jinja", data, result=selected, profile=profile,
+        root_folder=root_folder)
     await message.respond(Message(text))
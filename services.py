@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import time
+
+from .admission import run_in_background
+from .utils import gather_limited
+
+
+SERVICE_TYPES = {"movie": "radarr", "tv": "sonarr"}
+
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceCache:
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self.servers = {}
+        self.defaults = {}
+        self.mtime = None
+        self.lock = asyncio.Lock()
+        self.task = None
+
+    def is_stale(self):
+        return self.mtime is None or \
+            time.monotonic() - self.mtime > self.max_age
+
+    def invalidate(self):
+        self.mtime = None
+
+    async def get_server(self, session, media_type, server_id=None):
+        if self.is_stale():
+            async with self.lock:
+                if self.is_stale():
+                    await self.refresh(session)
+
+        service = SERVICE_TYPES.get(media_type)
+        if server_id is None:
+            server_id = self.defaults.get(service)
+        return self.servers.get(service, {}).get(server_id)
+
+    async def refresh(self, session):
+        servers = {}
+        defaults = {}
+        for service in SERVICE_TYPES.values():
+            get_servers = getattr(session, f"get_{service}")
+            get_server = getattr(session, f"get_{service}_server")
+            listing = await get_servers()
+            details = await gather_limited(
+                session.api.settings.concurrency,
+                (get_server(server["id"]) for server in listing))
+            servers[service] = {server["id"]: info
+                                for server, info in zip(listing, details)}
+            default = pick_default(listing)
+            if default is not None:
+                defaults[service] = default["id"]
+
+        self.servers = servers
+        self.defaults = defaults
+        self.mtime = time.monotonic()
+
+    async def run(self, session):
+        # Keep the cache warm, used for instances with an API key.
+        run_in_background()
+        while True:
+            await self.safe_refresh(session)
+            await asyncio.sleep(self.max_age)
+
+    def refresh_soon(self, session):
+        # Refresh in the background, the caller doesn't need the result.
+        self.invalidate()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.safe_refresh(session))
+
+    async def safe_refresh(self, session):
+        run_in_background()
+        try:
+            async with self.lock:
+                await self.refresh(session)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            logger.warning("failed to refresh service config: %s", error)
+
+
+def pick_default(listing):
+    # Prefer the default non-4K server, then any non-4K server.
+    regular = [server for server in listing if not server.get("is4k")]
+    for server in regular:
+        if server.get("isDefault"):
+            return server
+    if regular:
+        return regular[0]
+    if listing:
+        return listing[0]
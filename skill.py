@@ -2,54 +2,54 @@ import logging
 import asyncio
 import time
 import contextlib
-
-import jinja2
+import functools
 
 from opsdroid.skill import Skill
-from opsdroid.events import Message, Typing
+from opsdroid.events import Message, Typing, OpsdroidStarted
 from opsdroid.matchers import (match_regex,
                                match_catchall,
+                               match_event,
                                match_webhook)
 
+from . import codec
 from .config_schema import validate as validate_config
 from .search import search_flow
 from .requests import requests_flow
-from .api import OverseerrAPI, OverseerrError, MediaStatus
+from .api import (APISettings, OverseerrAPI, OverseerrError,
+                  OverseerrUnavailable)
 from .plex import Plex
-from .utils import parse_time, format_time_ago
+from .cache import TTLCache
+from .services import ServiceCache
+from .notify import Notifier, NotifyRoute
+from .metrics import Metrics, Gauge, webhook_latency
+from .posters import PosterCache
+from .watch import Watcher
+from .store import RequestStore
+from .templating import Templates
 
 
 CONTEXT_MAX_AGE = 180
 CONTEXT_MAX_REPLIES = 3
 HTTP_UNAUTHORIZED = 401
+HOUSEKEEPING_INTERVAL = 60
+# Notifications about changes to requests.
+STORE_TYPES = {"MEDIA_PENDING", "MEDIA_AUTO_APPROVED", "MEDIA_APPROVED",
+               "MEDIA_DECLINED", "MEDIA_AVAILABLE", "MEDIA_FAILED"}
 
 
 logger = logging.getLogger(__name__)
 
 
-def configure_jinja():
-    jinja = jinja2.Environment(
-        loader=jinja2.PackageLoader(__name__),
-        enable_async=True,
-        autoescape=False,
-        trim_blocks=True,
-        lstrip_blocks=True,
-    )
-    jinja.globals.update(dict(
-        MediaStatus=MediaStatus,
-        parse_time=parse_time,
-        format_time_ago=format_time_ago,
-    ))
-    return jinja
-
-
 @contextlib.asynccontextmanager
 async def error_responder(message):
     try:
         yield
     except OverseerrError as error:
         logger.error("server error: %s", error)
-        if error.status == HTTP_UNAUTHORIZED:
+        if isinstance(error, OverseerrUnavailable):
+            text = "Sorry, Overseerr isn't responding at the moment. " \
+                   "Please try again in a little while."
+        elif error.status == HTTP_UNAUTHORIZED:
             text = "Looks like I'm not authorized to do that on your " \
                    "behalf at the moment. Please use /login first " \
                    "(in a private chat with me)."
@@ -64,6 +64,13 @@ async def error_responder(message):
         await message.respond(Message(text))
 
 
+def get_request_id(data):
+    try:
+        return int(data["request"]["request_id"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
 class OverseerrSkill(Skill):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -72,35 +79,210 @@ class OverseerrSkill(Skill):
         self.bot_name = config["bot-name"]
         self.bot_url = config["bot-url"].rstrip("/")
         self.notify_room = config.get("notify-room")
-        self.jinja = configure_jinja()
-        self.plex = Plex(self.bot_name, self.bot_url,
-                         self.opsdroid.web_server.web_app,
-                         self.opsdroid.memory, self.jinja)
-
+        self.api_settings = APISettings.from_config(config)
+        self.metadata_cache = TTLCache(config["metadata-cache-size"],
+                                       config["metadata-cache-ttl"])
+        self.service_refresh_interval = config["service-refresh-interval"]
+        self.search_cache_size = config["search-cache-size"]
+        self.search_cache_ttl = config["search-cache-ttl"]
+        self.watch_interval = config["watch-interval"]
+        self.watch_max_interval = config["watch-max-interval"]
+        self.watch_step = config["watch-step"]
+        self.request_store = config["request-store"]
+        self.store_reconcile_interval = config["store-reconcile-interval"]
+        self.flow_max_pages = config["flow-max-pages"]
+        self.max_queued_messages = config["max-queued-messages"]
+        self.templates = Templates(config.get("template-cache"))
+        web_app = self.opsdroid.web_server.web_app
+        self.plex = Plex(self.bot_name, self.bot_url, web_app,
+                         self.opsdroid.memory, self.templates,
+                         config.get("token-cache-ttl"))
+        web_app.on_shutdown.append(self.on_shutdown)
+        self.metrics = Metrics(web_app)
+        poster_cache_size = config.get("poster-cache-size")
+        if poster_cache_size is not None:
+            poster_cache_size *= 1024 * 1024
+        self.posters = PosterCache(web_app, config.get("poster-cache"),
+                                   poster_cache_size)
+        self.notifier = Notifier(self.opsdroid, self.templates,
+                                 config["notify-window"],
+                                 config["notify-rate"])
+
+        self.apis = {}
+        self.watchers = {}
+        self.room_apis = {}
         self.rooms = {}
+        self.routes = {}
+        self.tasks = []
         for name, room in config["rooms"].items():
             self.configure_room(name, room)
+        self.register_metrics()
 
     def configure_room(self, name, config):
         if isinstance(config, str):
             url = config
             api_key = None
             more_rooms = []
+            notify_rooms = []
+            notify_types = []
         else:
             url = config["url"]
             api_key = config.get("api-key")
             more_rooms = config["more-rooms"]
+            notify_rooms = config["notify-rooms"]
+            notify_types = config["notify-types"]
 
-        api = OverseerrAPI(url, api_key)
-        self.rooms[name] = RoomContext(name, self.jinja, api)
+        api = self.get_api(url, api_key)
+        self.get_watcher(api)
+        self.room_apis[name] = api
+        if notify_rooms:
+            self.routes[name] = NotifyRoute(api, notify_rooms, notify_types)
 
         for name in more_rooms:
-            self.rooms[name] = RoomContext(name, self.jinja, api)
-
-    def get_user_context(self, event):
-        room = self.rooms.get(event.target)
+            self.room_apis[name] = api
+
+    def get_room(self, name, create=True):
+        # Rooms are set up when they're first used, not while opsdroid
+        # is loading the skill.
+        room = self.rooms.get(name)
+        if room is None and create:
+            api = self.room_apis.get(name)
+            if api is not None:
+                room = RoomContext(name, self.templates, api, self.posters,
+                                   self.watchers[api], self.flow_max_pages,
+                                   self.max_queued_messages)
+                self.rooms[name] = room
+        return room
+
+    def get_api(self, url, api_key):
+        # Rooms pointing at the same instance share the API and with it
+        # the connection pool.
+        key = (url.rstrip("/"), api_key)
+        try:
+            return self.apis[key]
+        except KeyError:
+            if api_key and self.request_store:
+                store = RequestStore(self.store_reconcile_interval)
+            else:
+                store = None
+            api = OverseerrAPI(url, api_key, self.api_settings,
+                               metadata_cache=self.metadata_cache,
+                               services=ServiceCache(
+                                   self.service_refresh_interval),
+                               search_cache=TTLCache(self.search_cache_size,
+                                                     self.search_cache_ttl),
+                               store=store)
+            self.apis[key] = api
+            return api
+
+    def get_watcher(self, api):
+        # One watcher per instance, so that all its watched requests are
+        # checked together.
+        try:
+            return self.watchers[api]
+        except KeyError:
+            watcher = Watcher(self.opsdroid, self.templates, api,
+                              self.watch_interval, self.watch_max_interval,
+                              self.watch_step)
+            self.watchers[api] = watcher
+            return watcher
+
+    def register_metrics(self):
+        registry = self.metrics.registry
+        registry.register(Gauge(
+            "overseerr_active_flows",
+            "Users in the middle of a command.",
+            ["room"], self.collect_active_flows))
+        registry.register(Gauge(
+            "overseerr_flow_memory_bytes",
+            "Estimated memory held by the results of active flows.",
+            ["room"], self.collect_flow_memory))
+        registry.register(Gauge(
+            "overseerr_queued_messages",
+            "Messages waiting to be handled by a command.",
+            ["room"], self.collect_queued_messages))
+        registry.register(Gauge(
+            "overseerr_api_waiting_calls",
+            "Overseerr API calls waiting for a free slot.",
+            ["url"], self.collect_waiting_calls))
+        registry.register(Gauge(
+            "overseerr_breaker_open",
+            "Whether calls to an instance are paused after failures.",
+            ["url"], self.collect_breakers))
+        registry.register(Gauge(
+            "overseerr_stored_requests",
+            "Requests in the local copy of an instance's request list.",
+            ["url"], self.collect_stores))
+        registry.register(Gauge(
+            "overseerr_watched_requests",
+            "Requests whose downloads are being watched.",
+            ["url"], self.collect_watches))
+        cache_stats = {
+            "hits": "Lookups answered from a cache.",
+            "misses": "Lookups that had to go to the server.",
+            "coalesced": "Lookups that waited for another's request.",
+            "entries": "Number of entries in a cache.",
+        }
+        for stat, documentation in cache_stats.items():
+            registry.register(Gauge(
+                f"overseerr_cache_{stat}", documentation, ["cache", "url"],
+                functools.partial(self.collect_caches, stat)))
+
+    def collect_active_flows(self):
+        return {(name,): room.count_active_flows()
+                for name, room in self.rooms.items()}
+
+    def collect_flow_memory(self):
+        return {(name,): room.measure_flows()
+                for name, room in self.rooms.items()}
+
+    def collect_queued_messages(self):
+        return {(name,): room.count_queued_messages()
+                for name, room in self.rooms.items()}
+
+    def collect_waiting_calls(self):
+        return {(api.parsed_url.geturl(),): api.admission.count_waiting()
+                for api in self.apis.values()}
+
+    def collect_breakers(self):
+        return {(api.parsed_url.geturl(),): int(api.breaker.is_open())
+                for api in self.apis.values()}
+
+    def collect_stores(self):
+        return {(api.parsed_url.geturl(),): len(api.store)
+                for api in self.apis.values() if api.store is not None}
+
+    def collect_watches(self):
+        return {(api.parsed_url.geturl(),): len(watcher)
+                for api, watcher in self.watchers.items()}
+
+    def collect_caches(self, stat):
+        caches = {("metadata", ""): self.metadata_cache}
+        for api in self.apis.values():
+            url = api.parsed_url.geturl()
+            caches["search", url] = api.search_cache
+        return {labels: len(cache) if stat == "entries"
+                else getattr(cache, stat)
+                for labels, cache in caches.items()}
+
+    async def on_shutdown(self, app):
+        self.notifier.stop()
+        for task in self.tasks:
+            task.cancel()
+        for room in self.rooms.values():
+            room.cancel()
+        for watcher in self.watchers.values():
+            watcher.close()
+        for api in self.apis.values():
+            if api.store is not None:
+                api.store.close()
+            await api.close()
+        await self.posters.close()
+
+    def get_user_context(self, event, create=True):
+        room = self.get_room(event.target, create)
         if room:
-            return room.get_user_context(event.user_id)
+            return room.get_user_context(event.user_id, create)
 
     ### Decorators
 
@@ -120,16 +302,24 @@ class OverseerrSkill(Skill):
                              message.user_id)
         return decorated
 
+    def with_existing_user_context(func):
+        # Like with_user_context but skips users without a context,
+        # so that chatter doesn't allocate one.
+        async def decorated(self, message):
+            context = self.get_user_context(message, create=False)
+            if context:
+                await func(self, message, context)
+        return decorated
+
     def with_api_session(func):
         async def decorated(self, message, context):
             user_id = message.user_id
-            session = context.new_session()
-            auth_token = await self.plex.get_auth_token(user_id)
-            if auth_token:
-                try:
-                    await session.login_plex(auth_token)
-                except OverseerrError:
-                    pass
+            authenticator = functools.partial(self.plex.get_auth_token,
+                                              user_id)
+            session = context.api.get_session(user_id, authenticator)
+            if not session.authenticated:
+                await session.login()
+            context.session = session
             await func(self, message, context)
         return decorated
 
@@ -138,6 +328,31 @@ class OverseerrSkill(Skill):
             context.start_flow(message, func(self, message, context))
         return decorated
 
+    ### Events
+
+    @match_event(OpsdroidStarted)
+    async def startup(self, event):
+        # Instances with an API key can be queried without a user, keep
+        # their service config warm and load their requests. Others fill
+        # up on first request.
+        for api in self.apis.values():
+            if api.api_key:
+                session = api.new_session()
+                task = asyncio.create_task(api.services.run(session))
+                self.tasks.append(task)
+                if api.store is not None:
+                    task = asyncio.create_task(api.store.run(session))
+                    self.tasks.append(task)
+        self.tasks.append(asyncio.create_task(self.housekeeping()))
+        self.notifier.start()
+        await self.templates.warm()
+
+    async def housekeeping(self):
+        while True:
+            await asyncio.sleep(HOUSEKEEPING_INTERVAL)
+            for api in self.apis.values():
+                api.forget_idle_sessions()
+
     ### Message handlers
 
     @match_regex(r"/h(elp)?$",
@@ -147,8 +362,7 @@ class OverseerrSkill(Skill):
     async def help(self, message, context):
         # context is unused but limits who can send the command
         await message.respond(Typing(True))
-        tmpl = self.jinja.get_template("help.jinja")
-        text = await tmpl.render_async({}, bot_name=self.bot_name)
+        text = await self.templates.render("help.jinja", bot_name=self.bot_name)
         await message.respond(Message(text))
 
     @match_regex(r"/login$",
@@ -158,8 +372,7 @@ class OverseerrSkill(Skill):
         # context is unused but limits who can send the command
         user_id = message.user_id
         auth_url = self.plex.get_login_url(user_id)
-        tmpl = self.jinja.get_template("login.jinja")
-        text = await tmpl.render_async({}, auth_url=auth_url)
+        text = await self.templates.render("login.jinja", auth_url=auth_url)
         await self.opsdroid.send(Message(text, target=user_id))
 
     @match_regex(r"/logout$",
@@ -171,12 +384,14 @@ class OverseerrSkill(Skill):
         user_id = message.user_id
         if await self.plex.get_auth_token(user_id):
             await self.plex.delete_auth_token(user_id)
+            for api in self.apis.values():
+                api.forget_session(user_id)
             text = "You have been logged out"
         else:
             text = "You haven't logged in yet"
         await self.opsdroid.send(Message(text, target=user_id))
 
-    @match_regex(r"/s(earch)?(?P<term>\s.*)?$",
+    @match_regex(r"(?s)/s(earch)?(?P<term>\s.*)?$",
                  case_sensitive=False)
     @with_error_responder
     @with_user_context
@@ -197,7 +412,7 @@ class OverseerrSkill(Skill):
     @match_regex(r"/abort$",
                  case_sensitive=False)
     @with_error_responder
-    @with_user_context
+    @with_existing_user_context
     async def abort(self, message, context):
         if context.in_flow():
             text = "OK, aborting"
@@ -206,65 +421,144 @@ class OverseerrSkill(Skill):
 
     @match_catchall(messages_only=True)
     @with_error_responder
-    @with_user_context
+    @with_existing_user_context
     async def catchall(self, message, context):
-        if context.in_flow():
-            context.put(message)
+        if context.in_flow() and not context.put(message):
+            # Tell the user once, until the flow catches up.
+            if not context.overloaded:
+                context.overloaded = True
+                text = "Hold on, I'm still busy with your previous " \
+                       "messages"
+                await message.respond(Message(text))
 
     ### Webhooks
 
     @match_webhook("notification")
     async def notification(self, request):
-        room = self.notify_room
-        if not room:
-            logger.info("received a notification but no "
-                        "notify-room is configured")
+        with webhook_latency.time():
+            await self.handle_notification(request)
+
+    async def handle_notification(self, request):
+        data = await request.json(loads=codec.loads)
+
+        # The instance is identified by its room name, passed in the
+        # webhook URL (?instance=name) or in the payload.
+        instance = request.query.get("instance") or data.get("instance")
+        notification_type = data.get("notification_type")
+        if notification_type == "MEDIA_AVAILABLE":
+            self.finish_watches(instance, data)
+        if notification_type in STORE_TYPES:
+            self.refresh_stores(instance, data)
+
+        route = self.get_notify_route(instance)
+        if not route:
+            logger.info("received a notification but no notify room "
+                        "is configured for instance %r", instance)
             return
 
-        try:
-            api = self.rooms[room].api
-        except KeyError:
-            api = None
+        # Delivered in the background, coalesced with similar events.
+        if route.accepts(data.get("notification_type")):
+            self.notifier.push(route, data)
+
+    def finish_watches(self, instance, data):
+        request_id = get_request_id(data)
+        if request_id is None:
+            return
+        for api in self.get_instance_apis(instance):
+            self.watchers[api].finish(request_id)
 
-        await self.opsdroid.send(Typing(True, target=room))
-        data = await request.json()
-        tmpl = self.jinja.get_template("notify.jinja")
-        text = await tmpl.render_async(data, api=api)
-        await self.opsdroid.send(Message(text, target=room))
+    def refresh_stores(self, instance, data):
+        request_id = get_request_id(data)
+        if request_id is None:
+            return
+        for api in self.get_instance_apis(instance):
+            if api.store is not None:
+                api.store.refresh_soon(request_id)
+
+    def get_instance_apis(self, instance):
+        # Without an instance name the event could be about any of them.
+        if instance in self.room_apis:
+            return [self.room_apis[instance]]
+        return list(self.apis.values())
+
+    def get_notify_route(self, instance):
+        if instance:
+            return self.routes.get(instance)
+        if self.notify_room:
+            api = self.room_apis.get(self.notify_room)
+            return NotifyRoute(api, [self.notify_room])
+        # Only one instance with notify rooms, no need to be specific.
+        if len(self.routes) == 1:
+            return next(iter(self.routes.values()))
 
 
 class RoomContext:
-    def __init__(self, name, jinja, api):
+    def __init__(self, name, templates, api, posters, watcher, max_pages,
+                 max_queued):
         self.name = name
-        self.jinja = jinja
+        self.templates = templates
         self.api = api
+        self.posters = posters
+        self.watcher = watcher
+        self.max_pages = max_pages
+        self.max_queued = max_queued
         self.user_context = {}
 
-    def get_user_context(self, user_id):
-        self.forget_old_user_contexts()
+    def get_user_context(self, user_id, create=True):
         try:
             return self.user_context[user_id]
         except KeyError:
+            if not create:
+                return None
             context = UserContext(self, user_id)
             self.user_context[user_id] = context
             return context
 
-    def forget_old_user_contexts(self):
-        for user_id, context in list(self.user_context.items()):
-            if context.get_age() > CONTEXT_MAX_AGE:
-                self.user_context.pop(user_id).cancel()
+    def count_active_flows(self):
+        return sum(context.in_flow()
+                   for context in self.user_context.values())
+
+    def measure_flows(self):
+        return sum(context.results.get_size()
+                   for context in self.user_context.values()
+                   if context.in_flow() and context.results is not None)
+
+    def count_queued_messages(self):
+        return sum(context.queue.qsize()
+                   for context in self.user_context.values()
+                   if context.queue is not None)
+
+    def forget_user_context(self, user_id):
+        context = self.user_context.pop(user_id, None)
+        if context:
+            context.close()
+
+    def cancel(self):
+        for user_id in list(self.user_context):
+            self.forget_user_context(user_id)
 
 
 class UserContext:
     def __init__(self, room_context, user_id):
         self.user_id = user_id
-        self.jinja = room_context.jinja
+        self.room_context = room_context
+        self.templates = room_context.templates
         self.api = room_context.api
+        self.posters = room_context.posters
+        self.watcher = room_context.watcher
+        self.max_pages = room_context.max_pages
+        self.max_queued = room_context.max_queued
+        self.overloaded = False
         self.session = None
-        self.mtime = 0
+        # Results of the current flow, for the metrics.
+        self.results = None
+        self.mtime = time.time()
         self.task = None
         self.queue = None
         self.last_message = None
+        self.background = set()
+        self.timer = None
+        self.schedule_expiry(CONTEXT_MAX_AGE)
 
     def touch(self):
         self.mtime = time.time()
@@ -272,33 +566,66 @@ class UserContext:
     def get_age(self):
         return time.time() - self.mtime
 
-    def new_session(self):
-        self.session = self.api.new_session()
-        return self.session
+    def schedule_expiry(self, delay):
+        loop = asyncio.get_running_loop()
+        self.timer = loop.call_later(delay, self.check_expiry)
+
+    def check_expiry(self):
+        # touch() only updates the time, the timer is moved when
+        # it fires too early.
+        age = self.get_age()
+        if age < CONTEXT_MAX_AGE:
+            self.schedule_expiry(CONTEXT_MAX_AGE - age)
+        else:
+            self.timer = None
+            self.room_context.forget_user_context(self.user_id)
 
     def start_flow(self, message, coro):
         self.cancel()
-        self.queue = asyncio.Queue()
+        self.queue = asyncio.Queue(self.max_queued)
+        self.overloaded = False
         async def flow():
             async with error_responder(message):
                 await coro
         self.task = asyncio.create_task(flow())
         self.touch()
 
+    def spawn(self, coro):
+        # Run a helper task that is cancelled together with the flow.
+        task = asyncio.create_task(coro)
+        self.background.add(task)
+        task.add_done_callback(self.background.discard)
+        return task
+
     def cancel(self):
+        for task in list(self.background):
+            task.cancel()
         if self.task:
             self.task.cancel()
             self.task = None
             self.queue = None
+            self.results = None
+
+    def close(self):
+        self.cancel()
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
 
     def in_flow(self):
         return not (self.task is None or self.task.done())
 
     def get(self):
+        self.overloaded = False
         return self.queue.get()
 
     def put(self, message):
-        self.queue.put_nowait(message)
+        # Returns False if the message was dropped.
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            return False
+        return True
 
     async def get_and_parse(self, parser, away=None):
         # Try to get a response from the user and parse it using
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+
+from .admission import run_in_background
+from .api import MediaStatus, RequestStatus, OverseerrError
+
+
+HTTP_NOT_FOUND = 404
+
+# Request and media statuses matched by the /request filters, the same
+# way the server does it.
+ANY_REQUEST = frozenset(RequestStatus)
+ANY_MEDIA = frozenset(MediaStatus)
+UNFINISHED = frozenset({MediaStatus.UNKNOWN, MediaStatus.PENDING,
+                        MediaStatus.PROCESSING,
+                        MediaStatus.PARTIALLY_AVAILABLE})
+FILTERS = {
+    "all": (ANY_REQUEST, ANY_MEDIA),
+    "approved": ({RequestStatus.APPROVED}, ANY_MEDIA),
+    "available": ({RequestStatus.APPROVED, RequestStatus.COMPLETED},
+                  {MediaStatus.AVAILABLE}),
+    "pending": ({RequestStatus.PENDING}, ANY_MEDIA),
+    "processing": ({RequestStatus.APPROVED}, UNFINISHED),
+    "unavailable": ({RequestStatus.PENDING, RequestStatus.APPROVED},
+                    UNFINISHED),
+    "failed": ({RequestStatus.FAILED}, ANY_MEDIA),
+}
+
+
+logger = logging.getLogger(__name__)
+
+
+class RequestStore:
+    # Copy of all the requests of an instance, so that listings don't
+    # have to go to the server. Loaded at startup, kept up to date by
+    # the notification webhook and the skill's own changes, and
+    # reloaded now and then in case some events were missed.
+    # Only used with an API key, when everyone can see all requests.
+    def __init__(self, reconcile_interval):
+        self.reconcile_interval = reconcile_interval
+        self.requests = {}
+        self.by_status = {}
+        self.titles = {}
+        self.changed = set()
+        self.ready = False
+        self.session = None
+        self.pending = set()
+
+    def __len__(self):
+        return len(self.requests)
+
+    def put(self, request):
+        request_id = request["id"]
+        self.discard(request_id)
+        self.requests[request_id] = request
+        self.by_status.setdefault(request["status"], set()).add(request_id)
+        self.changed.add(request_id)
+
+    def remove(self, request_id):
+        self.discard(request_id)
+        self.titles.pop(request_id, None)
+        self.changed.add(request_id)
+
+    def discard(self, request_id):
+        request = self.requests.pop(request_id, None)
+        if request is not None:
+            self.by_status[request["status"]].discard(request_id)
+
+    def set_title(self, request_id, info):
+        title = info.get("title") or info.get("name")
+        if title:
+            self.titles[request_id] = title.casefold()
+
+    def find(self, kind="all", title=None):
+        # Newest first, like the server's default order.
+        (statuses, media_statuses) = FILTERS[kind]
+        ids = set()
+        for status in statuses:
+            ids.update(self.by_status.get(status, ()))
+        if title is not None:
+            title = title.casefold()
+            ids = {request_id for request_id in ids
+                   if title in self.titles.get(request_id, "")}
+        results = [self.requests[request_id]
+                   for request_id in sorted(ids, reverse=True)]
+        return [request for request in results
+                if request["media"]["status"] in media_statuses]
+
+    def iter_requests(self, kind="all", title=None):
+        return StoredRequests(self.find(kind, title))
+
+    ### Loading
+
+    async def run(self, session):
+        self.session = session
+        run_in_background()
+        while True:
+            try:
+                await self.reconcile()
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                logger.warning("failed to load requests: %s", error)
+            await asyncio.sleep(self.reconcile_interval)
+
+    async def reconcile(self):
+        self.changed = set()
+        requests = {}
+        stream = self.session.iter_requests(kind="all")
+        try:
+            async for request in stream:
+                requests[request["id"]] = request
+        finally:
+            stream.close()
+
+        # Keep whatever changed while the pages were being loaded.
+        for request_id in self.changed:
+            request = self.requests.get(request_id)
+            if request is None:
+                requests.pop(request_id, None)
+            else:
+                requests[request_id] = request
+
+        self.requests = {}
+        self.by_status = {}
+        for request in requests.values():
+            self.put(request)
+        self.titles = {request_id: title
+                       for request_id, title in self.titles.items()
+                       if request_id in self.requests}
+        self.ready = True
+        await self.load_titles()
+
+    async def load_titles(self):
+        missing = [request for request in self.requests.values()
+                   if request["id"] not in self.titles]
+        infos = await self.session.get_infos(
+            [request["media"] for request in missing])
+        for request, info in zip(missing, infos):
+            self.set_title(request["id"], info)
+
+    ### Updates
+
+    def refresh_soon(self, request_id):
+        # Called for every webhook event and change made from chat,
+        # the store is updated in the background.
+        if self.session is None:
+            return
+        task = asyncio.create_task(self.safe_refresh(request_id))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    async def safe_refresh(self, request_id):
+        run_in_background()
+        try:
+            await self.refresh(request_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            logger.warning("failed to refresh request %s: %s",
+                           request_id, error)
+
+    async def refresh(self, request_id):
+        try:
+            request = await self.session.get_request(request_id)
+        except OverseerrError as error:
+            if error.status == HTTP_NOT_FOUND:
+                self.remove(request_id)
+                return
+            raise
+        self.put(request)
+        if request_id not in self.titles:
+            self.set_title(request_id,
+                           await self.session.get_info(request["media"]))
+
+    def close(self):
+        for task in list(self.pending):
+            task.cancel()
+
+
+class StoredRequests:
+    # Same interface as RequestStream, over requests from the store.
+    def __init__(self, requests):
+        self.requests = requests
+        self.total = len(requests)
+        self.skip = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.skip >= self.total:
+            raise StopAsyncIteration
+        request = self.requests[self.skip]
+        self.skip += 1
+        return request
+
+    async def take(self, count):
+        results = self.requests[self.skip:self.skip + count]
+        self.skip += len(results)
+        return results
+
+    def close(self):
+        pass
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import os
+import types
+from collections.abc import Mapping
+
+from . import metrics
+from .api import MediaStatus
+from .utils import parse_time, format_time_ago
+
+
+logger = logging.getLogger(__name__)
+
+
+def configure_jinja(cache_dir=None):
+    # Imported here, it's only needed once the first template is used.
+    import jinja2
+
+    bytecode_cache = None
+    if cache_dir:
+        # The cache only saves time, templates still work without it.
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            if not os.access(cache_dir, os.W_OK):
+                raise PermissionError(f"{cache_dir} is not writable")
+            bytecode_cache = jinja2.FileSystemBytecodeCache(cache_dir)
+        except OSError as error:
+            logger.warning("not caching compiled templates: %s", error)
+    jinja = jinja2.Environment(
+        loader=jinja2.PackageLoader(__name__),
+        bytecode_cache=bytecode_cache,
+        # Templates never change while running, keep all of them
+        # and don't check the files for updates.
+        auto_reload=False,
+        cache_size=-1,
+        enable_async=True,
+        autoescape=False,
+        trim_blocks=True,
+        lstrip_blocks=True,
+    )
+    jinja.globals.update(dict(
+        MediaStatus=MediaStatus,
+        parse_time=parse_time,
+        format_time_ago=format_time_ago,
+    ))
+    return jinja
+
+
+class Templates(Mapping):
+    # All templates are compiled together, not while opsdroid is loading
+    # the skill: the skill warms them in a thread once opsdroid has
+    # started, or the first render compiles them if that hasn't happened
+    # yet. Imports and extends inside the templates are served from the
+    # environment's cache.
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.jinja = None
+        self.compiled = None
+
+    @property
+    def templates(self):
+        if self.compiled is None:
+            self.compile()
+        return self.compiled
+
+    def compile(self):
+        # Doesn't touch self until done, it may run in a thread while
+        # the loop renders.
+        jinja = configure_jinja(self.cache_dir)
+        compiled = types.MappingProxyType({
+            name: jinja.get_template(name)
+            for name in jinja.list_templates(extensions=["jinja"])
+        })
+        (self.jinja, self.compiled) = (jinja, compiled)
+
+    async def warm(self):
+        if self.compiled is None:
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.compile)
+            except Exception:
+                logger.exception("failed to compile templates")
+
+    def __getitem__(self, name):
+        return self.templates[name]
+
+    def __iter__(self):
+        return iter(self.templates)
+
+    def __len__(self):
+        return len(self.templates)
+
+    async def render(self, name, *args, **kwargs):
+        with metrics.render_latency.time(name):
+            return await self.templates[name].render_async(*args, **kwargs)
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+
+# The repository root is the skill package, the benchmarks know how to
+# load it.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import load_skill_package  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def skill_package():
+    return load_skill_package()
@@ -0,0 +1,52 @@
+import asyncio
+import os
+import sys
+
+
+# Files opened, listed or stat'ed while `touched` is a list.
+touched = None
+
+
+def audit(event, args):
+    if touched is not None and event in ("open", "os.listdir",
+                                         "os.scandir"):
+        touched.append((event, args[0]))
+
+
+sys.addaudithook(audit)
+
+
+async def render_some(templates):
+    await templates.render("help.jinja", bot_name="bot")
+    await templates.render("search/results.jinja", results=[],
+                           term="title", skip=0, total=0)
+    await templates.render("notify.jinja",
+                           notification_type="MEDIA_AVAILABLE",
+                           subject="Title (2020)")
+
+
+def test_render_does_no_io(skill_package, monkeypatch):
+    templates = skill_package.templating.Templates()
+    # There is no audit event for stat, which is what the loaders use
+    # to look for changed templates.
+    real_stat = os.stat
+
+    def stat(path, *args, **kwargs):
+        if touched is not None:
+            touched.append(("os.stat", path))
+        return real_stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, "stat", stat)
+
+    async def main():
+        global touched
+        # The first render compiles all the templates.
+        await render_some(templates)
+        touched = []
+        try:
+            await render_some(templates)
+            return touched
+        finally:
+            touched = None
+
+    assert asyncio.run(main()) == []
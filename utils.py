@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 
 
@@ -42,3 +43,33 @@ def index_parser(array, default=None):
             return default
 
     return parser
+
+
+async def gather_limited(limit, aws, return_exceptions=False):
+    # Like asyncio.gather() but runs at most `limit` awaitables at a time.
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(run(aw) for aw in aws),
+                                return_exceptions=return_exceptions)
+
+
+def parse_selection(text):
+    # Parse "1-20", "3,5,9" or a mix of both into a sorted list of
+    # zero-based indexes. Returns None if the text isn't a valid
+    # selection.
+    indexes = set()
+    for part in text.replace(" ", "").split(","):
+        first, dash, last = part.partition("-")
+        try:
+            first = int(first)
+            last = int(last) if dash else first
+        except ValueError:
+            return None
+        if not 1 <= first <= last:
+            return None
+        indexes.update(range(first - 1, last))
+    return sorted(indexes)
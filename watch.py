@@ -0,0 +1,206 @@
+import asyncio
+import logging
+
+from opsdroid.events import Message
+
+from .admission import run_in_background
+from .api import MediaStatus, RequestStatus, OverseerrError
+
+
+HTTP_NOT_FOUND = 404
+# Requests in these states won't download anything anymore.
+STOPPED = frozenset({RequestStatus.DECLINED, RequestStatus.FAILED})
+
+
+logger = logging.getLogger(__name__)
+
+
+class Watch:
+    __slots__ = ("request_id", "media_type", "info", "targets", "user_id",
+                 "authenticator", "step", "progress")
+
+    def __init__(self, request_id, media_type, info, user_id, authenticator):
+        self.request_id = request_id
+        self.media_type = media_type
+        self.info = info
+        self.targets = set()
+        # Whose session is used to check on the request.
+        self.user_id = user_id
+        self.authenticator = authenticator
+        self.step = 0
+        self.progress = None
+
+
+class Watcher:
+    # Follows the downloads of watched requests of one instance. All of
+    # them are checked at once by listing the processing requests, often
+    # while downloads are moving and less and less often when they stall.
+    def __init__(self, opsdroid, templates, api, interval, max_interval,
+                 step):
+        self.opsdroid = opsdroid
+        self.templates = templates
+        self.api = api
+        self.min_interval = interval
+        self.max_interval = max_interval
+        self.interval = interval
+        self.step = step
+        self.watches = {}
+        self.task = None
+        self.pending = set()
+
+    def __len__(self):
+        return len(self.watches)
+
+    def watch(self, result, target, user_id, authenticator=None):
+        request_id = result.id
+        watch = self.watches.get(request_id)
+        if watch is None:
+            watch = Watch(request_id, result.media["mediaType"], result.info,
+                          user_id, authenticator)
+            watch.step = self.get_step(progress(result.media))
+            self.watches[request_id] = watch
+        watch.targets.add(target)
+        # Check soon, the new watch may be downloading already.
+        self.interval = self.min_interval
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    def unwatch(self, request_id, target):
+        watch = self.watches.get(request_id)
+        if watch is None or target not in watch.targets:
+            return False
+        watch.targets.discard(target)
+        if not watch.targets:
+            del self.watches[request_id]
+        return True
+
+    def is_watching(self, request_id, target):
+        watch = self.watches.get(request_id)
+        return watch is not None and target in watch.targets
+
+    def get_step(self, value):
+        return 0 if value is None else int(value // self.step)
+
+    async def run(self):
+        run_in_background()
+        while self.watches:
+            await asyncio.sleep(self.interval)
+            try:
+                moved = await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                logger.warning("failed to check downloads: %s", error)
+                moved = False
+            if moved:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * 2, self.max_interval)
+        self.task = None
+
+    async def sweep(self):
+        # With an API key one listing covers everyone, otherwise each
+        # user sees their own requests.
+        if self.api.api_key:
+            owners = {None: None}
+        else:
+            owners = {watch.user_id: watch.authenticator
+                      for watch in self.watches.values()}
+        processing = {}
+        for user_id, authenticator in owners.items():
+            session = await self.get_session(user_id, authenticator)
+            stream = session.iter_requests(kind="processing")
+            try:
+                async for request in stream:
+                    processing[request["id"]] = request
+            finally:
+                stream.close()
+
+        moved = False
+        for watch in list(self.watches.values()):
+            request = processing.get(watch.request_id)
+            if request is None:
+                await self.check_finished(watch, owners)
+                continue
+            value = progress(request["media"])
+            if value != watch.progress:
+                moved = True
+            watch.progress = value
+            step = self.get_step(value)
+            if step > watch.step:
+                watch.step = step
+                await self.notify(watch, value)
+        return moved
+
+    async def check_finished(self, watch, owners):
+        # Not processing anymore, in case the webhook didn't tell us.
+        user_id = None if self.api.api_key else watch.user_id
+        session = await self.get_session(user_id, owners[user_id])
+        try:
+            request = await session.get_request(watch.request_id)
+        except OverseerrError as error:
+            if error.status == HTTP_NOT_FOUND:
+                self.watches.pop(watch.request_id, None)
+                return
+            raise
+        if request["status"] in STOPPED:
+            self.watches.pop(watch.request_id, None)
+            return
+        status = request["media"]["status"]
+        if status in (MediaStatus.AVAILABLE, MediaStatus.PARTIALLY_AVAILABLE):
+            self.finish(watch.request_id)
+
+    async def get_session(self, user_id, authenticator):
+        session = self.api.get_session(user_id, authenticator)
+        if not session.authenticated and authenticator is not None:
+            await session.login()
+        return session
+
+    def finish(self, request_id):
+        # Called from the webhook, the last message is sent in the
+        # background.
+        watch = self.watches.pop(request_id, None)
+        if watch is not None:
+            task = asyncio.create_task(self.safe_notify(watch, None))
+            self.pending.add(task)
+            task.add_done_callback(self.pending.discard)
+
+    async def safe_notify(self, watch, value):
+        try:
+            await self.notify(watch, value)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("failed to tell that request %s is done",
+                             watch.request_id)
+
+    async def notify(self, watch, value):
+        text = await self.templates.render(
+            "watch.jinja", media_type=watch.media_type, info=watch.info,
+            progress=value)
+        for target in watch.targets:
+            try:
+                await self.opsdroid.send(Message(text, target=target))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("failed to send download progress to %s",
+                                 target)
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        for task in list(self.pending):
+            task.cancel()
+
+
+def progress(media):
+    # Percentage downloaded over all the downloads of the media, or
+    # None when nothing is downloading.
+    downloads = media.get("downloadStatus") or []
+    size = sum(download.get("size") or 0 for download in downloads)
+    if not size:
+        return None
+    left = sum(download.get("sizeLeft") or 0 for download in downloads)
+    return (size - left) * 100 / size